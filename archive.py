@@ -0,0 +1,207 @@
+"""
+Export the cards into a single archive file and import them from it, see `zk export` and `zk import`.
+
+The archive is a sequence of records. Each record is a JSON header on one line, followed by
+`length` bytes of body if the header has a length:
+
+    {"type": "zk-archive", "version": 1}
+    {"type": "card", "name": "19a", ..., "codec": "zlib", "length": 812}
+    <812 bytes: the content as it is stored in the blobs table>
+    ...
+    {"type": "daily", "card_date": "2024-01-02", "card_name": "42"}
+    ...
+    {"type": "end", "cards": 1234, "daily": 56}
+
+The contents are copied in their stored, compressed form, so nothing is compressed or
+decompressed on export. The cards are written in the order of their names. An interrupted
+export is resumed from the last complete card, and only a complete archive, which ends with
+the end record, can be imported. Import writes a transaction per batch and skips the cards that
+are already stored with the same content, so an interrupted import can simply be run again.
+Revision history isn't exported.
+"""
+
+import os
+import sys
+import json
+import sqlite3
+from typing import *
+
+from note_database import NoteDatabase
+
+VERSION = 1
+
+ARCHIVE = 'zk-archive'
+CARD = 'card'
+DAILY = 'daily'
+END = 'end'
+
+_SELECT_CARDS = ('select name, created_ns, modified_ns, mtime_ns, content_hash, notes.size, origin, codec, '
+                 'blobs.rowid, length(data), case when length(data) < ? then data end '
+                 'from notes join blobs on blobs.hash = notes.content_hash where name > ? order by name limit ?')
+
+CARD_FIELDS = ('name', 'created_ns', 'modified_ns', 'mtime_ns', 'content_hash', 'size', 'origin', 'codec')
+
+# Import saves a batch when it has this many bytes of card contents in memory
+IMPORT_BATCH_BYTES = 16 * 2**20
+
+
+class ArchiveResult(NamedTuple):
+    cards: int         # Cards written into the archive or the database
+    up_to_date: int    # Cards skipped on import because they were stored already
+    daily: int         # Daily note dates
+
+
+class _Resume(NamedTuple):
+    offset: int                # End of the last complete card record
+    last_card: Optional[str]
+    cards: int
+    complete: bool
+
+
+def export_archive(database_handle: sqlite3.Connection, archive_path: str,
+                   batch_size: int = NoteDatabase.DEFAULT_BATCH_SIZE) -> ArchiveResult:
+    """ Write all cards and daily notes into the archive, or complete an interrupted export """
+    store = NoteDatabase(database_handle)
+    resume = _resume_point(archive_path) if os.path.exists(archive_path) else None
+    if resume and resume.complete:
+        raise EnvironmentError(f'The archive {archive_path} exists')
+
+    with open(archive_path, 'r+b' if resume else 'wb') as fd:
+        if resume:
+            fd.truncate(resume.offset)
+            fd.seek(resume.offset)
+        if not resume or resume.offset == 0:
+            _write_record(fd, {'type': ARCHIVE, 'version': VERSION})
+        last_card = resume.last_card if resume else None
+        cards = resume.cards if resume else 0
+
+        # Without Connection.blobopen (Python < 3.11) every content is read whole
+        inline_limit = NoteDatabase.STREAMING_CHUNK_SIZE if hasattr(database_handle, 'blobopen') else sys.maxsize
+        cursor = database_handle.cursor()
+        while True:
+            cursor.execute(_SELECT_CARDS, (inline_limit, last_card or '', batch_size))
+            rows = cursor.fetchall()
+            for row in rows:
+                rowid, length, data = row[len(CARD_FIELDS):]
+                header = {'type': CARD, **dict(zip(CARD_FIELDS, row)), 'length': length}
+                _write_record(fd, header, data)
+                if data is None:
+                    store.copy_blob(rowid, fd)
+            cards += len(rows)
+            if len(rows) < batch_size:
+                break
+            last_card = rows[-1][0]
+
+        cursor.execute('select card_date, card_name from daily_notes order by card_date')
+        daily = 0
+        for card_date, card_name in cursor:
+            _write_record(fd, {'type': DAILY, 'card_date': card_date, 'card_name': card_name})
+            daily += 1
+        cursor.close()
+        _write_record(fd, {'type': END, 'cards': cards, 'daily': daily})
+    return ArchiveResult(cards, 0, daily)
+
+
+def import_archive(database_handle: sqlite3.Connection, archive_path: str,
+                   batch_size: int = NoteDatabase.DEFAULT_BATCH_SIZE) -> ArchiveResult:
+    """ Save the cards and the daily notes of a complete archive into the database. The cards keep
+    their origin and times. A card that is in the database already is replaced. A batch is saved
+    when it has `batch_size` cards or IMPORT_BATCH_BYTES of contents, and the contents of large
+    raw cards are copied into the database in chunks. """
+    resume = _resume_point(archive_path)
+    if not resume.complete:
+        raise EnvironmentError(f'The archive {archive_path} is incomplete')
+
+    store = NoteDatabase(database_handle)
+    written = 0
+    up_to_date = 0
+    daily_rows = []
+    changes = []
+    batch_bytes = 0
+
+    def save_batch():
+        nonlocal written, up_to_date, batch_bytes
+        stored = store.stored_changes(change['name'] for change in changes)
+        changed = [change for change in changes
+                   if change['name'] not in stored or stored[change['name']].content_hash != change['content_hash']]
+        with database_handle:
+            store.save_synced_cards(changed)
+        written += len(changed)
+        up_to_date += len(changes) - len(changed)
+        changes.clear()
+        batch_bytes = 0
+
+    def is_streamed(header: Dict[str, Any]) -> bool:
+        return header['type'] == CARD and store.is_streamed_blob(header['codec'], header['length'])
+
+    with open(archive_path, 'rb') as fd:
+        for header, body in _read_records(fd, with_body=True, skip_body=is_streamed):
+            if header['type'] == CARD:
+                change = {field: header[field] for field in CARD_FIELDS}
+                if body is None:
+                    # Only the beginning is kept, which save_synced_cards indexes
+                    body = store.copy_blob_from(header['content_hash'], header['length'], fd)
+                change['data'] = body
+                changes.append(change)
+                batch_bytes += len(body)
+                if len(changes) == batch_size or batch_bytes >= IMPORT_BATCH_BYTES:
+                    save_batch()
+            elif header['type'] == DAILY:
+                daily_rows.append((header['card_date'], header['card_name']))
+    save_batch()
+    with database_handle:
+        database_handle.executemany('insert or replace into daily_notes(card_date, card_name) values (?, ?)', daily_rows)
+    return ArchiveResult(written, up_to_date, len(daily_rows))
+
+
+def _write_record(fd: BinaryIO, header: Dict[str, Any], body: Optional[bytes] = None):
+    fd.write(json.dumps(header, separators=(',', ':')).encode('utf-8') + b'\n')
+    if body is not None:
+        fd.write(body)
+
+
+def _read_records(fd: BinaryIO, with_body: bool, skip_body: Optional[Callable[[Dict[str, Any]], bool]] = None
+                  ) -> Iterator[Tuple[Dict[str, Any], Optional[bytes]]]:
+    """ Yield the headers of the complete records, with the bodies or skipping over them
+    :param skip_body: Tells which bodies the caller reads itself from the file before the next record
+    """
+    first = True
+    while True:
+        line = fd.readline()
+        if not line.endswith(b'\n'):
+            return
+        header = json.loads(line)
+        if first:
+            if header.get('type') != ARCHIVE or header.get('version') != VERSION:
+                raise ValueError('Not a zk archive or an unknown version')
+            first = False
+        length = header.get('length')
+        body = None
+        if length is not None and not (skip_body and skip_body(header)):
+            if with_body:
+                body = fd.read(length)
+                if len(body) < length:
+                    return
+            else:
+                position = fd.seek(length, os.SEEK_CUR)
+                if position > os.fstat(fd.fileno()).st_size:
+                    return
+        yield header, body
+
+
+def _resume_point(archive_path: str) -> _Resume:
+    """ Read the headers of the archive to find where an interrupted export stopped """
+    offset = 0
+    last_card = None
+    cards = 0
+    complete = False
+    with open(archive_path, 'rb') as fd:
+        for header, _ in _read_records(fd, with_body=False):
+            if header['type'] in (ARCHIVE, CARD):
+                offset = fd.tell()
+            if header['type'] == CARD:
+                last_card = header['name']
+                cards += 1
+            elif header['type'] == END:
+                complete = True
+    return _Resume(offset, last_card, cards, complete)
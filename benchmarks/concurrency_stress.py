@@ -0,0 +1,95 @@
+""" Run many zk writers in parallel against one database and check that none of them fails
+with "database is locked", that every new card got its own major number and that every date
+got exactly one daily card.
+
+Each writer process creates new cards and saves them, and asks for the daily cards of the
+same few dates as the other writers.
+
+Usage:
+
+    $ python3 benchmarks/concurrency_stress.py [number of writers] [cards per writer]
+
+"""
+
+import os
+import sys
+import time
+import tempfile
+import datetime as dt
+import multiprocessing
+from typing import *
+
+from save_throughput import create_database
+
+import zk
+import daily
+import new_note
+
+DAILY_DATES = [dt.date(2024, 1, day) for day in range(1, 4)]
+
+
+def writer(notes_folder: str, database_path: str, count: int) -> Tuple[List[str], Dict[str, str]]:
+    """ Create and save `count` cards and reserve the daily cards
+    :return: The names of the created cards and the daily card of each date
+    """
+    notes = zk.Notes(notes_folder, database_path)
+    created = []
+    daily_cards = {}
+    for number in range(count):
+        card_name = new_note.next_available_major_note(notes.open_notes, notes.persistent_notes)
+        card_path = notes.open_notes.create_new_card(card_name, f'Card {number} of process {os.getpid()}\n')
+        notes.persistent_notes.save_card(card_name, card_path)
+        created.append(card_name)
+
+        date = DAILY_DATES[number % len(DAILY_DATES)]
+        minimum_major = new_note.largest_open_major_number(notes.open_notes)
+        card_name, reserved = daily.reserve_daily_card(date, notes.persistent_notes, notes.database_handle, minimum_major)
+        if reserved:
+            card_path = notes.open_notes.create_new_card(card_name, date.strftime('%F Daily\n'))
+            notes.persistent_notes.save_card(card_name, card_path)
+            created.append(card_name)
+        daily_cards[date.isoformat()] = card_name
+    notes.database_handle.close()
+    return created, daily_cards
+
+
+def stress(writers: int, count: int) -> bool:
+    with tempfile.TemporaryDirectory() as folder:
+        notes_folder = os.path.join(folder, 'notes')
+        os.mkdir(notes_folder)
+        database_path = os.path.join(folder, 'zk.db')
+        create_database(database_path).close()
+
+        start = time.perf_counter()
+        with multiprocessing.Pool(writers) as pool:
+            results = pool.starmap(writer, [(notes_folder, database_path, count)] * writers)
+        elapsed = time.perf_counter() - start
+
+        created = [card_name for cards, _ in results for card_name in cards]
+        daily_cards = {}
+        for _, dailies in results:
+            for date, card_name in dailies.items():
+                daily_cards.setdefault(date, set()).add(card_name)
+        notes = zk.Notes(notes_folder, database_path)
+        stored = notes.persistent_notes.find_all_notes()
+        notes.database_handle.close()
+
+    passed = True
+    if len(created) != len(set(created)):
+        print('FAILED: the same major number was allocated twice')
+        passed = False
+    if set(created) != stored:
+        print(f'FAILED: {len(created)} cards were created but {len(stored)} cards were saved')
+        passed = False
+    if any(len(card_names) != 1 for card_names in daily_cards.values()):
+        print(f'FAILED: a date has more than one daily card: {daily_cards}')
+        passed = False
+    print(f'{writers} writers created {len(created)} cards in {elapsed:.2f} s, '
+          f'{len(created) / elapsed:.0f} cards/s')
+    return passed
+
+
+if __name__ == '__main__':
+    writers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    sys.exit(0 if stress(writers, count) else 1)
@@ -0,0 +1,121 @@
+""" Build a synthetic notes folder for the benchmarks. The cards form a hierarchy of major
+cards and branches (123, 123a, 123a4, ...), link to each other like real cards and have mixed
+sizes: most are short, some are long and a few are larger than the streaming threshold of
+NoteDatabase. The first lines are headers like real ones, e.g. "2021-03-04 reading notes #books"
+or "2021-03-05 Daily", see database_functions.content_header. The corpus is the same for the
+same seed.
+
+Usage:
+
+    $ python3 benchmarks/corpus.py <folder> [number of cards] [seed]
+
+"""
+
+import os
+import sys
+import time
+import zlib
+import random
+from typing import *
+
+from save_throughput import create_database
+
+import card_name as CN
+
+MAX_DEPTH = 5
+NEW_MAJOR_PROBABILITY = 0.3
+
+# (probability, smallest size, largest size) of the card contents in bytes
+SIZES = [
+    (0.80, 200, 2 * 1024),
+    (0.19, 2 * 1024, 32 * 1024),
+    (0.01, 64 * 1024, 2 * 1024 * 1024),
+]
+
+WORDS = ('note card idea index link branch source quote question answer reading summary '
+         'argument example detail context method result theory practice memory system').split()
+
+TAGS = ('books', 'work', 'ideas', 'people', 'projects', 'writing')
+DAILY_PROBABILITY = 0.05
+TAG_PROBABILITY = 0.3
+
+# Spread the modification times over the past five years
+MODIFIED_RANGE_SECONDS = 5 * 365 * 24 * 3600
+LATEST_MODIFIED_SECONDS = 1_700_000_000
+
+
+def card_names(count: int, rng: random.Random) -> List[str]:
+    """ Return `count` card names in the order they would have been created """
+    names = []
+    last_major = 0
+    last_children: Dict[str, Optional[CN.CardPath]] = {}
+    while len(names) < count:
+        name = None
+        if names and rng.random() > NEW_MAJOR_PROBABILITY:
+            card = CN.parse(rng.choice(names))
+            if card.depth < MAX_DEPTH:
+                name = CN.next_child_name(card, last_children.get(card.name))
+                if name:
+                    last_children[card.name] = CN.parse(name)
+        if name is None:
+            last_major += 1
+            name = str(last_major)
+        names.append(name)
+    return names
+
+
+def card_content(name: str, names: List[str], rng: random.Random) -> bytes:
+    weights = [probability for probability, _, _ in SIZES]
+    _, smallest, largest = rng.choices(SIZES, weights)[0]
+    size = rng.randint(smallest, largest)
+
+    modified = LATEST_MODIFIED_SECONDS - rng.randrange(MODIFIED_RANGE_SECONDS)
+    lines = [card_header(modified, rng), '']
+    length = sum(len(line) + 1 for line in lines)
+    while length < size:
+        words = rng.choices(WORDS, k=rng.randint(8, 16))
+        if rng.random() < 0.3:
+            words.append(f'[{rng.choice(names)}]')
+        line = ' '.join(words) + '.'
+        lines.append(line)
+        length += len(line) + 1
+    return '\n'.join(lines).encode() + b'\n'
+
+
+def card_header(modified: int, rng: random.Random) -> str:
+    """ The first line of a card: the date, the Daily marker or a title, and sometimes #tags """
+    words = [time.strftime('%F', time.gmtime(modified))]
+    if rng.random() < DAILY_PROBABILITY:
+        words.append('Daily')
+    else:
+        words += rng.choices(WORDS, k=rng.randint(2, 5))
+    if rng.random() < TAG_PROBABILITY:
+        words += [f'#{tag}' for tag in rng.sample(TAGS, rng.randint(1, 2))]
+    return ' '.join(words)
+
+
+def generate_corpus(folder: str, count: int, seed: int = 0) -> List[str]:
+    """ Write `count` cards into the folder
+    :return: Names of the cards
+    """
+    rng = random.Random(seed)
+    names = card_names(count, rng)
+    for name in names:
+        card_path = os.path.join(folder, name)
+        with open(card_path, 'wb') as fd:
+            fd.write(card_content(name, names, rng))
+        modified = LATEST_MODIFIED_SECONDS - rng.randrange(MODIFIED_RANGE_SECONDS)
+        # Nanoseconds like on most file systems, derived from the name to keep the corpus of a seed
+        modified_ns = modified * 10**9 + zlib.crc32(name.encode('utf-8')) % 10**9
+        os.utime(card_path, ns=(modified_ns, modified_ns))
+    return names
+
+
+if __name__ == '__main__':
+    folder = sys.argv[1]
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    os.makedirs(folder, exist_ok=True)
+    names = generate_corpus(folder, count, seed)
+    create_database(os.path.join(folder, 'zk.db')).close()
+    print(f'Wrote {len(names)} cards and an empty database into {folder}')
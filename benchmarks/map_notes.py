@@ -0,0 +1,60 @@
+""" Measure how scripting.imap_notes and scripting.map_notes scale with the number of worker
+processes. The function decompresses every card and does some work with its text, and the
+map rewrites a tenth of the cards.
+
+Usage:
+
+    $ python3 benchmarks/map_notes.py [number of cards] [largest number of workers]
+
+"""
+
+import os
+import sys
+import time
+import hashlib
+import tempfile
+from typing import *
+
+from save_throughput import create_database, create_cards
+
+import scripting
+from note_database import NoteDatabase
+
+
+def digest_words(note: scripting.ScriptNote) -> int:
+    words = note.text().split()
+    for _ in range(5):
+        words = [hashlib.sha256(word.encode()).hexdigest()[:8] for word in words]
+    return len(words)
+
+
+def append_line(note: scripting.ScriptNote) -> Optional[str]:
+    digest_words(note)
+    if int(note.content_hash[:8], 16) % 10 != 0:
+        return None
+    return note.text() + 'Appended.\n'
+
+
+def measure(count: int, max_workers: int):
+    with tempfile.TemporaryDirectory() as folder:
+        cards = create_cards(folder, count)
+        database_handle = create_database(os.path.join(folder, 'zk.db'))
+        NoteDatabase(database_handle).save_cards(cards)
+
+        workers = 1
+        while workers <= max_workers:
+            start = time.perf_counter()
+            total = sum(words for _, words in scripting.imap_notes(database_handle, digest_words, workers))
+            print(f'imap {workers:2} workers  {count} cards: {total} words in {time.perf_counter() - start:.2f} s')
+            workers *= 2
+
+        start = time.perf_counter()
+        changed = scripting.map_notes(database_handle, append_line, max_workers)
+        print(f'map  {max_workers:2} workers  {count} cards: changed {changed} cards in {time.perf_counter() - start:.2f} s')
+        database_handle.close()
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+    measure(count, max_workers)
@@ -0,0 +1,71 @@
+""" Compare the throughput of saving cards one by one (a commit per card) and saving them
+with the batched NoteDatabase.save_cards (one transaction). The last measurement saves an
+already saved folder again, which should only stat the files.
+
+Usage:
+
+    $ python3 benchmarks/save_throughput.py [number of cards] [batch size]
+
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+
+PROJECT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_FOLDER)
+
+import database_init
+from note_database import NoteDatabase
+
+
+def create_database(database_path: str) -> sqlite3.Connection:
+    database_handle = sqlite3.connect(database_path)
+    database_init.initialize_database(database_handle)
+    return database_handle
+
+
+def create_cards(folder: str, count: int):
+    cards = []
+    for number in range(1, count + 1):
+        card_path = os.path.join(folder, str(number))
+        with open(card_path, 'wb') as fd:
+            fd.write(b'2024-01-01 Card %d\n\n' % number + b'Lorem ipsum dolor sit amet. ' * (number % 40 + 1))
+        cards.append((str(number), card_path))
+    return cards
+
+
+def measure(label: str, count: int, save):
+    with tempfile.TemporaryDirectory() as folder:
+        cards = create_cards(folder, count)
+        database_handle = create_database(os.path.join(folder, 'zk.db'))
+        database = NoteDatabase(database_handle)
+        start = time.perf_counter()
+        save(database, cards)
+        elapsed = time.perf_counter() - start
+        database_handle.close()
+    print(f'{label:<12} {count} cards in {elapsed:.3f} s, {count / elapsed:.0f} cards/s')
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else NoteDatabase.DEFAULT_BATCH_SIZE
+
+    def save_one_by_one(database, cards):
+        for card_name, card_path in cards:
+            database.save_card(card_name, card_path)
+
+    def save_in_batches(database, cards):
+        database.save_cards(cards, batch_size=batch_size)
+
+    def save_twice(database, cards):
+        database.save_cards(cards, batch_size=batch_size)
+        start = time.perf_counter()
+        database.save_cards(cards, batch_size=batch_size)
+        print(f'{"no-op save":<12} {count} cards in {time.perf_counter() - start:.3f} s')
+
+    measure('one by one', count, save_one_by_one)
+    measure('batched', count, save_in_batches)
+    measure('save twice', count, save_twice)
@@ -0,0 +1,93 @@
+""" Check the start-up time of the commands that open the editor. Each command is run with
+`python3 -X importtime` and a stub editor, and fails the check if it imports a module that
+only other commands need or if its imports take longer than the budget.
+
+The modules that the interpreter imports at start-up are not counted. The first run of each
+command compiles the modules into a temporary bytecode cache, and the best of the following
+runs is reported, as on an installation with compiled modules.
+
+Usage:
+
+    $ python3 benchmarks/startup_time.py [budget in milliseconds] [runs]
+
+"""
+
+import os
+import sys
+import stat
+import tempfile
+import subprocess
+
+from save_throughput import PROJECT_FOLDER, create_database
+
+DEFAULT_BUDGET_MS = 40
+DEFAULT_RUNS = 5
+
+COMMANDS = [['card'], ['daily'], ['branch', '1']]
+
+# Modules that opening a card doesn't need
+FORBIDDEN_MODULES = {'socket', 'getpass', 'argparse', 'glob', 'logging', 'difflib',
+                     'scripts.bump_version', 'database_init', 'watch'}
+
+
+def import_times(stderr: str) -> dict:
+    """ Return the self time in microseconds of each imported module from the -X importtime output """
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, module = line[len('import time:'):].split('|')
+        times[module.strip()] = int(self_us)
+    return times
+
+
+def run_python(folder: str, environment: dict, arguments: list) -> dict:
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + arguments,
+                            cwd=folder, env=environment, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f'{" ".join(arguments)} failed:\n{result.stderr}')
+    return import_times(result.stderr)
+
+
+def measure(budget_ms: float, runs: int) -> bool:
+    passed = True
+    with tempfile.TemporaryDirectory() as folder:
+        database_path = os.path.join(folder, 'zk.db')
+        create_database(database_path).close()
+
+        # A stub editor that exits immediately
+        editor_folder = os.path.join(folder, 'bin')
+        os.mkdir(editor_folder)
+        editor_path = os.path.join(editor_folder, 'vim')
+        with open(editor_path, 'w') as fd:
+            fd.write('#!/bin/sh\nexit 0\n')
+        os.chmod(editor_path, os.stat(editor_path).st_mode | stat.S_IEXEC)
+
+        environment = dict(os.environ)
+        environment['PATH'] = editor_folder + os.pathsep + environment.get('PATH', '')
+        environment['PYTHONPYCACHEPREFIX'] = os.path.join(folder, 'pycache')
+        environment.pop('PYTHONDONTWRITEBYTECODE', None)
+
+        notes_folder = os.path.join(folder, 'notes')
+        os.mkdir(notes_folder)
+        interpreter_modules = set(run_python(notes_folder, environment, ['-c', 'pass']))
+        for command in COMMANDS:
+            arguments = [os.path.join(PROJECT_FOLDER, 'zk.py'), '--database', database_path] + command
+            run_python(notes_folder, environment, arguments)
+            timings = [run_python(notes_folder, environment, arguments) for _ in range(runs)]
+            timings = [{module: time for module, time in times.items() if module not in interpreter_modules}
+                       for times in timings]
+            best_ms = min(sum(times.values()) for times in timings) / 1000
+            forbidden = sorted(FORBIDDEN_MODULES.intersection(timings[0]))
+            ok = best_ms <= budget_ms and not forbidden
+            passed = passed and ok
+            print(f'zk {" ".join(command):<10} imports {len(timings[0])} modules in {best_ms:.1f} ms '
+                  f'(budget {budget_ms:.0f} ms)' + (f', imports {", ".join(forbidden)}' if forbidden else '')
+                  + ('' if ok else '  FAILED'))
+    return passed
+
+
+if __name__ == '__main__':
+    budget_ms = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUDGET_MS
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_RUNS
+    sys.exit(0 if measure(budget_ms, runs) else 1)
@@ -0,0 +1,55 @@
+""" Report the database size and the save and read throughput of each compression codec.
+A tenth of the cards are duplicates of other cards, which are stored only once.
+
+Usage:
+
+    $ python3 benchmarks/storage_size.py [number of cards] [compression level]
+
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+from save_throughput import create_database, create_cards
+
+import database_functions
+from note_database import NoteDatabase
+
+
+def measure(codec: str, level: int, count: int):
+    with tempfile.TemporaryDirectory() as folder:
+        cards = create_cards(folder, count)
+        for card_name, card_path in cards[:count // 10]:
+            with open(card_path, 'wb') as fd:
+                fd.write(b'2024-01-01\n\nThe same card again.\n' * 20)
+        database_path = os.path.join(folder, 'zk.db')
+        database_handle = create_database(database_path)
+        database = NoteDatabase(database_handle, codec=codec, level=level)
+
+        start = time.perf_counter()
+        database.save_cards(cards)
+        save_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        read_count = sum(1 for _ in database.iter_cards())
+        read_elapsed = time.perf_counter() - start
+
+        content_size, stored_size, blob_count = database_handle.execute(
+            'select sum(size), sum(length(data)), count(*) from blobs').fetchone()
+        database_handle.execute('vacuum')
+        database_handle.close()
+        database_size = os.path.getsize(database_path)
+
+    print(f'{codec + ":" + str(level):<8} {blob_count} blobs for {count} cards, '
+          f'content {content_size} B stored as {stored_size} B ({stored_size / content_size:.0%}), '
+          f'database {database_size} B, '
+          f'save {count / save_elapsed:.0f} cards/s, read {read_count / read_elapsed:.0f} cards/s')
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    level = int(sys.argv[2]) if len(sys.argv) > 2 else database_functions.DEFAULT_LEVEL
+    for codec in database_functions.CODECS:
+        measure(codec, level, count)
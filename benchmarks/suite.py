@@ -0,0 +1,170 @@
+""" Measure how the zk commands scale with the number of cards. A synthetic corpus (see
+corpus.py) is generated for each scale and the operations are run on it in order, each in a
+fresh process so that the peak RSS is the operation's own:
+
+- save:          save a folder of new cards
+- save-noop:     save the same folder again
+- show-modified: list the cards after a hundredth of them has been modified
+- iterate:       walk all cards in natural order with Notes.iter_notes
+- backlinks:     find the cards that refer to the first card
+- graph:         find the cards within two links of the first card
+- date:          find the cards with the date of the first card on their first line
+- tag:           find the cards with a #tag on their first line
+- card:          allocate and create a new major card
+- branch:        create a new branch of the first card
+- pack:          save the cards and remove them from the folder
+- unpack:        write the cards back into the folder
+
+The results are printed as JSON with the wall time, cards/s, peak RSS and the number of SQL
+statements of each operation, so that they can be compared between commits. The statements
+are counted with the trace callback of the connection, which sees each row of an executemany
+as a statement of its own.
+
+Usage:
+
+    $ python3 benchmarks/suite.py [scales, e.g. 1000,10000,100000] [output file] [seed]
+
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import platform
+import resource
+import tempfile
+import subprocess
+from typing import *
+
+from save_throughput import PROJECT_FOLDER, create_database
+from corpus import TAGS, generate_corpus
+
+import zk
+import new_note
+import note_folder as NF
+
+DEFAULT_SCALES = [1000, 10000]
+MODIFIED_FRACTION = 0.01
+
+
+def run_operation(operation: str, notes_folder: str, database_path: str) -> Tuple[int, int]:
+    """ Run one operation with a fresh Notes
+    :return: The number of cards that the operation handled or scanned and the number of SQL statements
+    """
+    notes = zk.Notes(notes_folder, database_path)
+    statements = []
+    notes.database_handle.set_trace_callback(statements.append)
+    if operation in ('save', 'save-noop'):
+        count = len(zk.save_open_notes_into_database(notes))
+    elif operation == 'show-modified':
+        NF.modified_cards(notes.open_notes, notes.database_handle)
+        count = len(notes.open_notes.find_all_notes())
+    elif operation == 'iterate':
+        count = sum(1 for note in notes.iter_notes() if note.card.depth >= 0)
+    elif operation == 'backlinks':
+        count = len(notes.persistent_notes.backlinks('1'))
+    elif operation == 'graph':
+        count = len(notes.persistent_notes.neighbourhood('1', 2))
+    elif operation == 'date':
+        with open(notes.open_notes.fullpath_of_open_card('1'), 'rb') as fd:
+            date = fd.read(10).decode()
+        count = len(notes.persistent_notes.cards_of_date(date))
+    elif operation == 'tag':
+        count = len(notes.persistent_notes.cards_with_tag(TAGS[0]))
+    elif operation == 'card':
+        card_name = new_note.next_available_major_note(notes.open_notes, notes.persistent_notes)
+        notes.open_notes.create_new_card(card_name, time.strftime('%F\n\n\n'))
+        count = 1
+    elif operation == 'branch':
+        card_name = new_note.next_available_subcard_name('1', notes.open_notes, notes.persistent_notes)
+        notes.open_notes.create_new_card(card_name, '')
+        count = 1
+    elif operation == 'pack':
+        count = len(notes.open_notes.find_all_notes())
+        zk.pack_open_notes_into_database(notes)
+    elif operation == 'unpack':
+        count = zk.unpack_open_notes_from_database(notes).written
+    else:
+        raise ValueError(f'Unknown operation: {operation}')
+    notes.database_handle.close()
+    return count, len(statements)
+
+
+def measure_operation(operation: str, notes_folder: str, database_path: str) -> Dict[str, Any]:
+    """ Run the operation in a new process and return its measurements """
+    result = subprocess.run([sys.executable, __file__, '--run', operation, notes_folder, database_path],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f'{operation} failed:\n{result.stderr}')
+    return json.loads(result.stdout)
+
+
+def modify_cards(notes_folder: str, fraction: float, seed: int):
+    rng = random.Random(seed)
+    card_names = sorted(name for name in os.listdir(notes_folder) if NF.card_kind(name))
+    for card_name in rng.sample(card_names, max(1, int(len(card_names) * fraction))):
+        with open(os.path.join(notes_folder, card_name), 'ab') as fd:
+            fd.write(b'One more line.\n')
+
+
+def measure_scale(count: int, seed: int) -> List[Dict[str, Any]]:
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        notes_folder = os.path.join(folder, 'notes')
+        database_path = os.path.join(folder, 'zk.db')
+        os.mkdir(notes_folder)
+        generate_corpus(notes_folder, count, seed)
+        create_database(database_path).close()
+
+        for operation in ('save', 'save-noop', 'show-modified', 'iterate', 'backlinks', 'graph', 'date', 'tag', 'card', 'branch', 'pack', 'unpack'):
+            if operation == 'show-modified':
+                modify_cards(notes_folder, MODIFIED_FRACTION, seed)
+            result = measure_operation(operation, notes_folder, database_path)
+            result.update(scale=count)
+            results.append(result)
+            print(f'{count:>7} {operation:<14} {result["cards"]:>7} cards in {result["seconds"]:.3f} s, '
+                  f'{result["cards_per_second"]:.0f} cards/s, peak RSS {result["peak_rss_kb"]} kB, '
+                  f'{result["sql_statements"]} SQL statements', file=sys.stderr)
+        results.append({'scale': count, 'operation': 'database-size', 'bytes': os.path.getsize(database_path)})
+    return results
+
+
+def git_commit() -> Optional[str]:
+    result = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=PROJECT_FOLDER, capture_output=True, text=True)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--run':
+        operation, notes_folder, database_path = sys.argv[2:5]
+        start = time.perf_counter()
+        count, statement_count = run_operation(operation, notes_folder, database_path)
+        elapsed = time.perf_counter() - start
+        print(json.dumps({
+            'operation': operation,
+            'cards': count,
+            'seconds': round(elapsed, 6),
+            'cards_per_second': round(count / elapsed, 1) if elapsed else None,
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'sql_statements': statement_count,
+        }))
+        sys.exit(0)
+
+    scales = [int(scale) for scale in sys.argv[1].split(',')] if len(sys.argv) > 1 else DEFAULT_SCALES
+    output_path = sys.argv[2] if len(sys.argv) > 2 else None
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'seed': seed,
+        'results': [result for count in scales for result in measure_scale(count, seed)],
+    }
+    if output_path:
+        with open(output_path, 'w') as fd:
+            json.dump(report, fd, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
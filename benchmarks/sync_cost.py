@@ -0,0 +1,52 @@
+""" Show that the cost of syncing two databases grows with the number of changed cards, not with
+the number of cards. Two databases are synced once, then a few cards are changed in one of
+them and the databases are synced again.
+
+Usage:
+
+    $ python3 benchmarks/sync_cost.py [number of cards] [number of changed cards]
+
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+from save_throughput import create_database, create_cards
+
+import sync
+from note_database import NoteDatabase
+
+
+def measure(count: int, changed: int):
+    with tempfile.TemporaryDirectory() as folder:
+        cards = create_cards(folder, count)
+        local_handle = create_database(os.path.join(folder, 'local.db'))
+        remote_handle = create_database(os.path.join(folder, 'remote.db'))
+        NoteDatabase(local_handle, origin='local').save_cards(cards)
+
+        start = time.perf_counter()
+        result = sync.sync(local_handle, remote_handle)
+        print(f'first sync     {count} cards: sent {result.pushed} cards in {time.perf_counter() - start:.3f} s')
+
+        for card_name, card_path in cards[:changed]:
+            with open(card_path, 'ab') as fd:
+                fd.write(b'Changed.\n')
+        NoteDatabase(remote_handle, origin='remote').save_cards(cards[:changed])
+
+        statements = []
+        local_handle.set_trace_callback(statements.append)
+        start = time.perf_counter()
+        result = sync.sync(local_handle, remote_handle)
+        elapsed = time.perf_counter() - start
+        print(f'second sync    {count} cards: received {result.pulled} cards in {elapsed:.3f} s, '
+              f'{len(statements)} statements in the local database')
+        local_handle.close()
+        remote_handle.close()
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    changed = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    measure(count, changed)
@@ -0,0 +1,68 @@
+"""
+Card names are hierarchical. A major card is a number (19) and its branches alternate
+letters and numbers: 19a, 19b are branches of 19, 19a1, 19a2 are branches of 19a, and so on.
+"""
+
+import re
+from typing import *
+
+IS_CARD_NAME = re.compile('^[0-9]+([a-z]+[0-9]+)*[a-z]*$')
+SEGMENT = re.compile('[0-9]+|[a-z]+')
+
+SORT_KEY_SEPARATOR = '.'
+SORT_KEY_NUMBER_WIDTH = 10
+
+
+class CardPath(NamedTuple):
+    name: str
+    major: int
+    segments: Tuple[str, ...]  # e.g. ('19', 'a', '2') for 19a2
+    parent: Optional[str]      # None for major cards
+    depth: int                 # 0 for major cards
+    sort_key: str              # Natural order of the cards, e.g. 19a2 before 19a10
+
+
+def parse(card_name: str) -> Optional[CardPath]:
+    """ Return the parsed card name or None if the name is not a card name """
+    if not IS_CARD_NAME.match(card_name):
+        return None
+    segments = tuple(SEGMENT.findall(card_name))
+    parent = ''.join(segments[:-1]) or None
+    return CardPath(card_name, int(segments[0]), segments, parent, len(segments) - 1, sort_key(segments))
+
+
+def sort_key(segments: Sequence[str]) -> str:
+    """ Numbers are padded with zeros so that the keys sort in natural order. The descendants of
+    a card have keys in the range returned by `descendant_range`. """
+    return SORT_KEY_SEPARATOR.join(segment.zfill(SORT_KEY_NUMBER_WIDTH) if segment.isdigit() else segment
+                                   for segment in segments)
+
+
+def natural_key(card_name: str) -> str:
+    """ Key for sorting names in natural order. Names that aren't card names, e.g. backup files
+    like 2~, sort by the name itself. """
+    card = parse(card_name)
+    return card.sort_key if card else card_name
+
+
+def descendant_range(card: CardPath) -> Tuple[str, str]:
+    """ Return the half-open range of the sort keys of all descendants of the card """
+    return (card.sort_key + SORT_KEY_SEPARATOR, card.sort_key + chr(ord(SORT_KEY_SEPARATOR) + 1))
+
+
+def next_child_name(card: CardPath, last_child: Optional[CardPath]) -> Optional[str]:
+    """ Return the name of the next branch of the card, or None if the letters have run out
+    i.e. the branch 'z' exists already.
+    :param last_child: The last existing branch of the card, if any
+    """
+    if card.segments[-1].isdigit():
+        if last_child is None:
+            return card.name + 'a'
+        last_letter = last_child.segments[-1]
+        if len(last_letter) != 1 or last_letter == 'z':
+            return None
+        return card.name + chr(ord(last_letter) + 1)
+    else:
+        if last_child is None:
+            return card.name + '1'
+        return card.name + str(int(last_child.segments[-1]) + 1)
@@ -3,6 +3,13 @@ import sqlite3
 import datetime as dt
 from typing import *
 
+from note_database import NoteDatabase
+
+# Cards marked as daily, and cards whose first line is "YYYY-MM-DD Daily" but which haven't been marked
+_FIND_DAILY_CARD = ('select card_name from daily_notes where card_date = :date '
+                    'union all select name from (select name from notes where header_date = :date and daily = 1 order by sort_key) '
+                    'limit 1')
+
 
 def smart_date(human_input: List[str]) -> dt.date:
     date = dt.date.today()
@@ -40,9 +47,9 @@ def smart_date(human_input: List[str]) -> dt.date:
 def daily_card_name(date: dt.date, database_handle: sqlite3.Connection) -> Optional[str]:
     """ Return the name of a daily card for given date, if one exists. Otherwise None.
     @Robustness: Not exception safe """
-    args = (date.strftime('%F'),)
+    args = {'date': date.strftime('%F')}
     cursor = database_handle.cursor()
-    cursor.execute('select card_name from daily_notes where card_date = ?', args)
+    cursor.execute(_FIND_DAILY_CARD, args)
     card_name_row = cursor.fetchone()
     cursor.close()
     if card_name_row:
@@ -50,6 +57,34 @@ def daily_card_name(date: dt.date, database_handle: sqlite3.Connection) -> Optio
     return None
 
 
+def reserve_daily_card(date: dt.date, store: NoteDatabase, database_handle: sqlite3.Connection,
+                       minimum_major: int = 0) -> Tuple[str, bool]:
+    """ Return the daily card for given date. If there is none, a new major card is allocated and
+    marked as the daily card. The lookup and the reservation are done in one BEGIN IMMEDIATE
+    transaction, so concurrent processes get the same daily card.
+    :param minimum_major: See NoteDatabase.allocate_major_number
+    :return: Name of the card and True if it was reserved now, i.e. the card has to be created
+    """
+    card_date = date.strftime('%F')
+    cursor = database_handle.cursor()
+    try:
+        cursor.execute('begin immediate')
+        cursor.execute(_FIND_DAILY_CARD, {'date': card_date})
+        card_name_row = cursor.fetchone()
+        if card_name_row:
+            database_handle.commit()
+            return card_name_row[0], False
+        card_name = str(store.allocate_major_number(minimum_major, cursor))
+        cursor.execute('insert into daily_notes(card_name, card_date) values (?, ?)', (card_name, card_date))
+        database_handle.commit()
+    except:
+        database_handle.rollback()
+        raise
+    finally:
+        cursor.close()
+    return card_name, True
+
+
 def set_the_daily_card(card_name: str, date: dt.date, database_handle: sqlite3.Connection):
     """ Mark an existing card as daily card
     @Robustness: Not exception safe
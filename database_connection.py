@@ -0,0 +1,37 @@
+"""
+Open connections to the notes database. Every connection is configured the same way:
+
+- WAL journaling, so that readers don't block the writer and the writer doesn't block readers
+- A busy timeout, so that a process waits for the write lock of another process instead of
+  failing with "database is locked"
+- synchronous=NORMAL, which is safe with WAL: a power loss can lose the last transactions
+  but doesn't corrupt the database
+- A larger page cache and memory-mapped I/O for reading
+- The SQL functions of database_functions
+"""
+
+import sqlite3
+from typing import *
+
+import database_functions
+
+BUSY_TIMEOUT_SECONDS = 30.0
+
+PRAGMAS = (
+    ('journal_mode', 'wal'),
+    ('synchronous', 'normal'),
+    ('cache_size', -16 * 1024),       # KiB when negative
+    ('mmap_size', 256 * 1024 * 1024),
+)
+
+
+def connect(database_path: str, factory: Type[sqlite3.Connection] = sqlite3.Connection) -> sqlite3.Connection:
+    """ Open the database, e.g. with profiling.TracedConnection as the factory """
+    database_handle = sqlite3.connect(database_path, timeout=BUSY_TIMEOUT_SECONDS, factory=factory)
+    cursor = database_handle.cursor()
+    for name, value in PRAGMAS:
+        cursor.execute(f'pragma {name} = {value}')
+        cursor.fetchall()
+    cursor.close()
+    database_functions.register(database_handle)
+    return database_handle
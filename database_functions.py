@@ -0,0 +1,161 @@
+"""
+SQL functions that the schema migrations and queries can use. They have to be registered
+to each connection with `register` before use.
+"""
+
+import re
+import zlib
+import sqlite3
+from typing import *
+
+import card_name
+
+
+def content_hash(content: Optional[Union[bytes, str]]) -> Optional[str]:
+    """ Hash of a card content as stored in notes.content_hash """
+    if content is None:
+        return None
+    if isinstance(content, str):
+        content = content.encode()
+    import hashlib
+    return hashlib.sha256(content).hexdigest()
+
+
+def file_content_hash(path: str, chunk_size: int = 2**20) -> str:
+    """ Hash of a file as stored in notes.content_hash, read in chunks """
+    import hashlib
+    hasher = hashlib.sha256()
+    buffer = memoryview(bytearray(chunk_size))
+    with open(path, 'rb') as fd:
+        while True:
+            length = fd.readinto(buffer)
+            if not length:
+                break
+            hasher.update(buffer[:length])
+    return hasher.hexdigest()
+
+
+def content_text(content: Optional[Union[bytes, str]]) -> Optional[str]:
+    """ Text of a card content for the full-text index """
+    if content is None or isinstance(content, str):
+        return content
+    return bytes(content).decode('utf-8', errors='replace')
+
+
+# A reference to another card is its name in brackets, e.g. [19a2] or [[19a2]]
+CARD_LINK = re.compile(r'\[\[?([0-9]+(?:[a-z]+[0-9]+)*[a-z]*)\]\]?')
+
+
+def content_links(content: Optional[Union[bytes, str]]) -> List[str]:
+    """ Names of the cards that a card content refers to, in the order of their first reference """
+    text = content_text(content)
+    if not text:
+        return []
+    return list(dict.fromkeys(CARD_LINK.findall(text)))
+
+
+def _content_links_json(content: Optional[bytes]) -> str:
+    """ SQL function zk_links, which returns the links as a JSON array for json_each """
+    import json
+    return json.dumps(content_links(content))
+
+
+# The first line of a card: an optional date, the Daily marker of daily cards, the title and #tags,
+# e.g. "2024-01-31 Daily #work" or "2024-01-31 Reading notes #books"
+HEADER_DATE = re.compile(r'^([0-9]{4}-[0-9]{2}-[0-9]{2})(?:\s|$)')
+HEADER_MAX_LENGTH = 4096
+DAILY_MARKER = 'Daily'
+
+
+class CardHeader(NamedTuple):
+    date: Optional[str]     # YYYY-MM-DD
+    title: Optional[str]
+    daily: bool
+    tags: List[str]
+
+
+def content_header(content: Optional[Union[bytes, str]]) -> CardHeader:
+    """ Parse the first line of a card content """
+    text = content_text(content[:HEADER_MAX_LENGTH] if content else content) or ''
+    first_line = text.split('\n', 1)[0].strip()
+    match = HEADER_DATE.match(first_line)
+    date = match.group(1) if match else None
+    words = first_line[match.end():].split() if match else first_line.split()
+    daily = date is not None and words[:1] == [DAILY_MARKER]
+    if daily:
+        words = words[1:]
+    tags = list(dict.fromkeys(word[1:] for word in words if word.startswith('#') and len(word) > 1))
+    title = ' '.join(word for word in words if not (word.startswith('#') and len(word) > 1))
+    return CardHeader(date, title or None, daily, tags)
+
+
+def _content_header_json(content: Optional[bytes]) -> str:
+    """ SQL function zk_header, which returns the header as a JSON object for json_extract """
+    import json
+    return json.dumps(content_header(content)._asdict())
+
+
+CODECS = ('raw', 'zlib', 'lzma')
+DEFAULT_CODEC = 'zlib'
+DEFAULT_LEVEL = 6
+
+
+def compress(content: bytes, codec: str = DEFAULT_CODEC, level: int = DEFAULT_LEVEL) -> Tuple[str, bytes]:
+    """ Compress a card content for the blobs table. Content that doesn't get smaller is stored raw.
+    :return: The codec that was used and the compressed data
+    """
+    if codec == 'raw':
+        return ('raw', content)
+    elif codec == 'zlib':
+        data = zlib.compress(content, level)
+    elif codec == 'lzma':
+        import lzma
+        data = lzma.compress(content, preset=level)
+    else:
+        raise ValueError(f'Unknown codec: {codec}')
+    if len(data) >= len(content):
+        return ('raw', content)
+    return (codec, data)
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    if codec == 'raw':
+        return bytes(data)
+    elif codec == 'zlib':
+        return zlib.decompress(data)
+    elif codec == 'lzma':
+        import lzma
+        return lzma.decompress(data)
+    raise ValueError(f'Unknown codec: {codec}')
+
+
+def _compressed_data(content: Optional[bytes]) -> Optional[bytes]:
+    """ SQL function zk_compress, which compresses with the default codec. Use with zk_codec. """
+    if content is None:
+        return None
+    return compress(bytes(content))[1]
+
+
+def _compressed_codec(content: Optional[bytes]) -> Optional[str]:
+    if content is None:
+        return None
+    return compress(bytes(content))[0]
+
+
+def _card_path_field(field: str) -> Callable[[str], Any]:
+    def card_path_field(name: str):
+        card = card_name.parse(name)
+        return getattr(card, field) if card else None
+    return card_path_field
+
+
+def register(database_handle: sqlite3.Connection):
+    database_handle.create_function('zk_sha256', 1, content_hash, deterministic=True)
+    database_handle.create_function('zk_text', 1, content_text, deterministic=True)
+    database_handle.create_function('zk_links', 1, _content_links_json, deterministic=True)
+    database_handle.create_function('zk_header', 1, _content_header_json, deterministic=True)
+    database_handle.create_function('zk_compress', 1, _compressed_data, deterministic=True)
+    database_handle.create_function('zk_codec', 1, _compressed_codec, deterministic=True)
+    database_handle.create_function('zk_decompress', 2, decompress, deterministic=True)
+    for field in ('major', 'parent', 'depth', 'sort_key'):
+        database_handle.create_function(f'zk_card_{field}', 1, _card_path_field(field), deterministic=True)
@@ -7,12 +7,15 @@ to sql/schema.py when all database in use have been upgraded to newest version.
 """
 
 import os
-import sys
 import sqlite3
 
+import migrations
+import scripts.bump_version as bump_version
+
+
 def initialize_database(database_handle: sqlite3.Connection):
-    """ Initialize an empty database. """
-    project_folder = os.path.dirname(os.path.abspath(sys.argv[0]))
+    """ Initialize an empty database and upgrade it to the newest schema version. """
+    project_folder = os.path.dirname(os.path.abspath(__file__))
     schema_path = os.path.join(project_folder, 'sql', 'schema.sql')
     cursor = database_handle.cursor()
     with open(schema_path, 'r') as fd:
@@ -20,3 +23,6 @@ def initialize_database(database_handle: sqlite3.Connection):
     database_handle.commit()
     cursor.close()
 
+    bump_version.run(database_handle)
+    migrations.migrate(database_handle)
+
@@ -0,0 +1,111 @@
+"""
+Binary deltas between two versions of a card. The versions are matched line by line and
+the delta is a list of operations that build the target from the source:
+
+- COPY offset length: copy bytes from the source
+- INSERT length bytes: insert new bytes
+
+Numbers are encoded as unsigned LEB128 varints.
+
+The lines are matched with difflib, which is quadratic in the worst case, e.g. for many equal
+lines. Only the lines between the common beginning and end of the versions are matched, and if
+there are too many of them they are replaced as a whole.
+"""
+
+from typing import *
+
+COPY = 0
+INSERT = 1
+
+# Largest product of the numbers of source and target lines that are matched with difflib
+MAX_MATCHED_LINE_PAIRS = 250_000
+
+
+def diff(source: bytes, target: bytes) -> bytes:
+    """ Return a delta that turns the source into the target """
+    import difflib
+    source_lines = source.splitlines(keepends=True)
+    target_lines = target.splitlines(keepends=True)
+    source_offsets = _line_offsets(source_lines)
+    target_offsets = _line_offsets(target_lines)
+
+    prefix = _common_length(source_lines, target_lines)
+    suffix = _common_length(source_lines[prefix:][::-1], target_lines[prefix:][::-1])
+    source_end, target_end = len(source_lines) - suffix, len(target_lines) - suffix
+    opcodes = [('equal', 0, prefix, 0, prefix)]
+    if (source_end - prefix) * (target_end - prefix) <= MAX_MATCHED_LINE_PAIRS:
+        matcher = difflib.SequenceMatcher(None, source_lines[prefix:source_end], target_lines[prefix:target_end], autojunk=False)
+        opcodes += [(tag, prefix + source_begin, prefix + source_end, prefix + target_begin, prefix + target_end)
+                    for tag, source_begin, source_end, target_begin, target_end in matcher.get_opcodes()]
+    else:
+        opcodes.append(('replace', prefix, source_end, prefix, target_end))
+    opcodes.append(('equal', source_end, len(source_lines), target_end, len(target_lines)))
+
+    delta = bytearray()
+    for tag, source_begin, source_end, target_begin, target_end in opcodes:
+        if tag == 'equal' and source_end > source_begin:
+            delta.append(COPY)
+            _write_varint(delta, source_offsets[source_begin])
+            _write_varint(delta, source_offsets[source_end] - source_offsets[source_begin])
+        elif target_end > target_begin:
+            inserted = target[target_offsets[target_begin]:target_offsets[target_end]]
+            delta.append(INSERT)
+            _write_varint(delta, len(inserted))
+            delta += inserted
+    return bytes(delta)
+
+
+def patch(source: bytes, delta: bytes) -> bytes:
+    """ Apply a delta from `diff` to the source """
+    target = bytearray()
+    position = 0
+    while position < len(delta):
+        operation = delta[position]
+        position += 1
+        if operation == COPY:
+            offset, position = _read_varint(delta, position)
+            length, position = _read_varint(delta, position)
+            target += source[offset:offset + length]
+        elif operation == INSERT:
+            length, position = _read_varint(delta, position)
+            target += delta[position:position + length]
+            position += length
+        else:
+            raise ValueError(f'Invalid delta operation: {operation}')
+    return bytes(target)
+
+
+def _common_length(source_lines: List[bytes], target_lines: List[bytes]) -> int:
+    """ Number of equal lines at the beginning of both """
+    length = 0
+    for source_line, target_line in zip(source_lines, target_lines):
+        if source_line != target_line:
+            break
+        length += 1
+    return length
+
+
+def _line_offsets(lines: List[bytes]) -> List[int]:
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line))
+    return offsets
+
+
+def _write_varint(buffer: bytearray, number: int):
+    while number >= 0x80:
+        buffer.append((number & 0x7f) | 0x80)
+        number >>= 7
+    buffer.append(number)
+
+
+def _read_varint(buffer: bytes, position: int) -> Tuple[int, int]:
+    number = 0
+    shift = 0
+    while True:
+        byte = buffer[position]
+        position += 1
+        number |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return number, position
+        shift += 7
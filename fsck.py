@@ -0,0 +1,138 @@
+"""
+Check that the notes folder and the database agree, see `zk fsck`.
+
+- The SQLite integrity check of the database file
+- Every card refers to a stored blob, and every daily note to a saved card
+- An open card whose stat data equals the stat data saved with it has the saved content. A
+  card whose stat data has changed is only modified, which isn't a problem.
+- With `blobs`, every blob decompresses to content with the hash that it's stored under
+
+The files and the blobs are hashed on a thread pool, a batch of cards at a time, while the
+stored hashes are read from the database. hashlib and zlib release the GIL for large inputs,
+so the check is bound by I/O.
+"""
+
+import sqlite3
+from typing import *
+from concurrent.futures import ThreadPoolExecutor
+
+import database_functions
+from database_functions import file_content_hash
+from note_database import NoteDatabase, is_unchanged_stat
+
+INTEGRITY = 'integrity'
+MISSING_BLOB = 'missing blob'
+CORRUPT_BLOB = 'corrupt blob'
+UNUSED_BLOB = 'unused blob'
+ORPHANED_DAILY = 'orphaned daily'
+CONTENT_MISMATCH = 'content mismatch'
+
+
+class Problem(NamedTuple):
+    kind: str
+    subject: str     # Card name, blob hash or daily note date
+    detail: str
+
+
+def check(notes, blobs: bool = False, workers: Optional[int] = None,
+          batch_size: int = NoteDatabase.DEFAULT_BATCH_SIZE) -> List[Problem]:
+    """ Run all checks
+    :param notes: zk.Notes
+    :param blobs: Also decompress and hash every stored blob
+    """
+    database_handle = notes.database_handle
+    problems = check_database(database_handle)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        problems += check_folder(notes, pool, batch_size)
+        if blobs:
+            problems += check_blobs(database_handle, pool, batch_size)
+    return problems
+
+
+def check_database(database_handle: sqlite3.Connection) -> List[Problem]:
+    cursor = database_handle.cursor()
+    cursor.execute('pragma integrity_check')
+    problems = [Problem(INTEGRITY, 'database', message) for message, in cursor.fetchall() if message != 'ok']
+    cursor.execute('select name, content_hash from notes where not exists (select 1 from blobs where hash = notes.content_hash)')
+    problems += [Problem(MISSING_BLOB, card_name, f'No blob {digest}') for card_name, digest in cursor.fetchall()]
+    cursor.execute('select card_date, card_name from daily_notes where not exists (select 1 from notes where name = daily_notes.card_name)')
+    problems += [Problem(ORPHANED_DAILY, card_date, f'The card {card_name} is not saved') for card_date, card_name in cursor.fetchall()]
+    cursor.execute('select hash from blobs where not exists (select 1 from notes where content_hash = blobs.hash) '
+                   "and not exists (select 1 from revisions where kind = 'blob' and content_hash = blobs.hash)")
+    problems += [Problem(UNUSED_BLOB, digest, 'Not referred to by a card or a revision') for digest, in cursor.fetchall()]
+    cursor.close()
+    return problems
+
+
+def check_folder(notes, pool: ThreadPoolExecutor, batch_size: int = NoteDatabase.DEFAULT_BATCH_SIZE) -> List[Problem]:
+    """ Hash the open cards that look unchanged since they were saved and compare them to the saved hashes """
+    open_stats = notes.open_notes.stat_of_open_cards()
+    problems = []
+    for stored_stats in NoteDatabase(notes.database_handle).iter_stored_stats(batch_size):
+        unchanged = {card_name: stored.content_hash for card_name, stored in stored_stats.items()
+                     if card_name in open_stats and _has_saved_stat(open_stats[card_name], stored)}
+        problems += [Problem(CONTENT_MISMATCH, card_name, 'The file has the saved stat data but different content')
+                     for card_name in mismatching_cards(notes, unchanged, pool)]
+    return problems
+
+
+def verify_saved_cards(notes, card_names: Iterable[str], workers: Optional[int] = None,
+                       batch_size: int = NoteDatabase.DEFAULT_BATCH_SIZE) -> List[str]:
+    """ Return the open cards whose content differs from the saved content, e.g. before removing them.
+    Every card is hashed regardless of its stat data. Cards that aren't saved are returned too. """
+    from note_database import _batches
+    store = NoteDatabase(notes.database_handle)
+    different = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for batch in _batches(card_names, batch_size):
+            stored_stats = store.stored_stats(batch)
+            different += [card_name for card_name in batch if card_name not in stored_stats]
+            saved = {card_name: stored.content_hash for card_name, stored in stored_stats.items()}
+            different += mismatching_cards(notes, saved, pool)
+    return different
+
+
+def mismatching_cards(notes, saved_hashes: Dict[str, str], pool: ThreadPoolExecutor) -> List[str]:
+    """ Hash the open cards on the pool and return the ones that differ from the given hashes """
+    card_names = list(saved_hashes)
+    paths = [notes.open_notes.fullpath_of_open_card(card_name) for card_name in card_names]
+    return [card_name for card_name, digest in zip(card_names, pool.map(_file_hash, paths))
+            if digest != saved_hashes[card_name]]
+
+
+def check_blobs(database_handle: sqlite3.Connection, pool: ThreadPoolExecutor,
+                batch_size: int = NoteDatabase.DEFAULT_BATCH_SIZE) -> List[Problem]:
+    problems = []
+    last_rowid = 0
+    cursor = database_handle.cursor()
+    while True:
+        cursor.execute('select rowid, hash, codec, data from blobs where rowid > ? order by rowid limit ?', (last_rowid, batch_size))
+        rows = cursor.fetchall()
+        for (_, digest, _, _), actual in zip(rows, pool.map(_blob_hash, rows)):
+            if actual != digest:
+                problems.append(Problem(CORRUPT_BLOB, digest, actual if actual.startswith('Cannot') else f'The content hashes to {actual}'))
+        if len(rows) < batch_size:
+            break
+        last_rowid = rows[-1][0]
+    cursor.close()
+    return problems
+
+
+def _has_saved_stat(stat, stored) -> bool:
+    # Stat data that is equal but ambiguous, e.g. whole seconds, is compared too
+    return is_unchanged_stat(stat, stored) or (stored.size == stat.st_size and stored.mtime_ns == stat.st_mtime_ns)
+
+
+def _file_hash(path: str) -> Optional[str]:
+    try:
+        return file_content_hash(path)
+    except FileNotFoundError:
+        return None
+
+
+def _blob_hash(row: Tuple[int, str, str, bytes]) -> str:
+    _, _, codec, data = row
+    try:
+        return database_functions.content_hash(database_functions.decompress(codec, data))
+    except Exception as error:
+        return f'Cannot decompress: {error}'
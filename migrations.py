@@ -0,0 +1,210 @@
+"""
+Schema migrations. A migration moves the database one version up or down and it's either
+
+- an SQL script `sql/upgrade_{N}_to_{N+1}.sql` or `sql/rollback_{N+1}_to_{N}.sql`, or
+- a Python module with the same name and the extension .py, for migrations that rewrite the
+  rows of a large table.
+
+`migrate` plans the whole path from the current version to the target before it changes
+anything, and applies the steps in order. Each SQL step and the new version number are written
+in one transaction, so a failing step leaves the database at the previous version.
+
+A Python migration has three parts:
+
+    BEFORE = 'alter table notes add column ...'    # SQL run first, optional
+    TABLE = 'notes'                                # Table whose rows are rewritten
+
+    def rewrite(cursor, after_rowid, last_rowid):  # Rewrite the rows after_rowid < rowid <= last_rowid
+        ...
+
+    AFTER = 'create index ...'                     # SQL run last, optional
+
+BEFORE is run in a transaction of its own. The rows are then rewritten a batch at a time, each
+batch in a transaction that also saves the last rewritten rowid into migration_checkpoint.
+AFTER is run in one transaction with the new version number. If the migration is interrupted,
+the database stays at the previous version and the next `migrate` continues from the
+checkpoint. Until then, `migrate` refuses to go anywhere else, because the rewritten rows only
+make sense to the interrupted step. A checkpoint of a step that doesn't start from the current
+version can't be continued, and it is removed.
+"""
+
+import os
+import re
+import sqlite3
+from typing import *
+
+import database_functions
+
+PROJECT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+MIGRATIONS_FOLDER = os.path.join(PROJECT_FOLDER, 'sql')
+
+DEFAULT_BATCH_SIZE = 10000
+
+UPGRADE = 'upgrade'
+ROLLBACK = 'rollback'
+
+_CREATE_CHECKPOINT = 'create table if not exists migration_checkpoint (step text primary key, last_rowid integer not null)'
+
+
+class Step(NamedTuple):
+    from_version: int
+    to_version: int
+    path: str
+
+    @property
+    def name(self) -> str:
+        return os.path.splitext(os.path.basename(self.path))[0]
+
+
+def latest_version(folder: str = MIGRATIONS_FOLDER) -> int:
+    """ The newest version that there is an upgrade for """
+    versions = [1]
+    for file_name in os.listdir(folder):
+        match = re.match(r'^upgrade_[0-9]+_to_([0-9]+)\.(sql|py)$', file_name)
+        if match:
+            versions.append(int(match.group(1)))
+    return max(versions)
+
+
+def current_version(database_handle: sqlite3.Connection) -> int:
+    cursor = database_handle.cursor()
+    cursor.execute('select version from schema_version')
+    version = int(cursor.fetchone()[0])
+    cursor.close()
+    return version
+
+
+def plan(from_version: int, to_version: int, folder: str = MIGRATIONS_FOLDER) -> List[Step]:
+    """ Return the steps from one version to another. Raises RuntimeError if a step is missing. """
+    direction = UPGRADE if to_version > from_version else ROLLBACK
+    increment = 1 if direction == UPGRADE else -1
+    steps = []
+    for version in range(from_version, to_version, increment):
+        base_path = os.path.join(folder, f'{direction}_{version}_to_{version + increment}')
+        paths = [base_path + extension for extension in ('.sql', '.py') if os.path.isfile(base_path + extension)]
+        if len(paths) != 1:
+            raise RuntimeError(f'Missing or ambiguous migration: {base_path}.sql or .py')
+        steps.append(Step(version, version + increment, paths[0]))
+    return steps
+
+
+def migrate(database_handle: sqlite3.Connection, to_version: Optional[int] = None, folder: str = MIGRATIONS_FOLDER,
+            batch_size: int = DEFAULT_BATCH_SIZE, progress: Optional[Callable[[Step, int, int], None]] = None) -> List[Step]:
+    """ Upgrade or roll back the database to the version, the latest one by default
+    :param progress: Called with the step, the last rewritten rowid and the largest rowid after
+        each batch of a Python migration
+    :return: The steps that were applied
+    """
+    if to_version is None:
+        to_version = latest_version(folder)
+    from_version = current_version(database_handle)
+    steps = plan(from_version, to_version, folder)
+    if not steps:
+        return steps
+    interrupted = _interrupted_step(database_handle, from_version)
+    if interrupted and steps[0].name != interrupted:
+        raise RuntimeError(f'The migration {interrupted} was interrupted, complete it before going to the version {to_version}')
+
+    database_functions.register(database_handle)
+    if database_handle.in_transaction:
+        database_handle.commit()
+    isolation_level = database_handle.isolation_level
+    # The transactions are started and committed here, not by the sqlite3 module
+    database_handle.isolation_level = None
+    try:
+        for step in steps:
+            if current_version(database_handle) != step.from_version:
+                raise RuntimeError(f'Invalid version bump, going from {current_version(database_handle)} to {step.to_version}')
+            if step.path.endswith('.py'):
+                _apply_python_step(database_handle, step, batch_size, progress)
+            else:
+                with open(step.path, 'r') as fd:
+                    _execute_in_transaction(database_handle, fd.read(), step.to_version)
+    finally:
+        database_handle.isolation_level = isolation_level
+    return steps
+
+
+def _interrupted_step(database_handle: sqlite3.Connection, version: int) -> Optional[str]:
+    """ Return the name of the interrupted Python migration from the version, if any. Checkpoints of
+    migrations from other versions are removed. """
+    cursor = database_handle.cursor()
+    cursor.execute("select 1 from sqlite_master where type = 'table' and name = 'migration_checkpoint'")
+    if cursor.fetchone() is None:
+        cursor.close()
+        return None
+    cursor.execute('select step from migration_checkpoint')
+    names = [name for name, in cursor.fetchall()]
+    stale_names = [name for name in names if _from_version(name) != version]
+    if stale_names:
+        cursor.executemany('delete from migration_checkpoint where step = ?', [(name,) for name in stale_names])
+        database_handle.commit()
+    cursor.close()
+    interrupted = [name for name in names if name not in stale_names]
+    return interrupted[0] if interrupted else None
+
+
+def _from_version(step_name: str) -> Optional[int]:
+    match = re.match(r'^(?:upgrade|rollback)_([0-9]+)_to_[0-9]+$', step_name)
+    return int(match.group(1)) if match else None
+
+
+def _apply_python_step(database_handle: sqlite3.Connection, step: Step, batch_size: int,
+                       progress: Optional[Callable[[Step, int, int], None]]):
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(f'migration_{step.name}', step.path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    cursor = database_handle.cursor()
+    cursor.execute(_CREATE_CHECKPOINT)
+    cursor.execute('select last_rowid from migration_checkpoint where step = ?', (step.name,))
+    checkpoint = cursor.fetchone()
+    if checkpoint is None:
+        _execute_in_transaction(database_handle, getattr(module, 'BEFORE', '') +
+                                f"\n;\ninsert into migration_checkpoint(step, last_rowid) values ('{step.name}', 0);")
+        after_rowid = 0
+    else:
+        after_rowid = checkpoint[0]
+
+    cursor.execute(f'select max(rowid) from {module.TABLE}')
+    max_rowid = cursor.fetchone()[0] or 0
+    while True:
+        cursor.execute(f'select rowid from {module.TABLE} where rowid > ? order by rowid limit 1 offset ?',
+                       (after_rowid, batch_size - 1))
+        last_row = cursor.fetchone()
+        last_rowid = last_row[0] if last_row else max(max_rowid, after_rowid)
+        if last_rowid > after_rowid:
+            try:
+                cursor.execute('begin immediate')
+                module.rewrite(cursor, after_rowid, last_rowid)
+                cursor.execute('update migration_checkpoint set last_rowid = ? where step = ?', (last_rowid, step.name))
+                cursor.execute('commit')
+            except BaseException:
+                if database_handle.in_transaction:
+                    cursor.execute('rollback')
+                raise
+            after_rowid = last_rowid
+            if progress:
+                progress(step, after_rowid, max_rowid)
+        if last_row is None:
+            break
+    cursor.close()
+
+    _execute_in_transaction(database_handle, getattr(module, 'AFTER', '') +
+                            f"\n;\ndelete from migration_checkpoint where step = '{step.name}';", step.to_version)
+
+
+def _execute_in_transaction(database_handle: sqlite3.Connection, sql: str, version: Optional[int] = None):
+    """ Run the script and set the version in one transaction. The connection must be in autocommit mode. """
+    if version is not None:
+        sql += f'\n;\ndelete from schema_version;\ninsert into schema_version(version) values ({int(version)});'
+    cursor = database_handle.cursor()
+    try:
+        cursor.executescript(f'begin immediate;\n{sql}\n;\ncommit;')
+    except BaseException:
+        if database_handle.in_transaction:
+            database_handle.execute('rollback')
+        raise
+    finally:
+        cursor.close()
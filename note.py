@@ -0,0 +1,119 @@
+"""
+Cards as objects for the tools that are built on zk.Notes. A Note is small: it holds the name,
+the times and the size that were read with the listing, and the parsed card name, the stat data
+and the content are looked up only when they are asked for. See Notes.iter_notes.
+"""
+
+import os
+from typing import *
+
+import card_name as CN
+from card_name import CardPath
+
+PAGE_SIZE = 500
+
+
+class Note:
+    __slots__ = ('name', 'created_ns', 'modified_ns', 'size', 'in_folder', 'in_database', '_card', '_stat', '_notes')
+
+    def __init__(self, notes, name: str, created_ns: Optional[int] = None, modified_ns: Optional[int] = None,
+                 size: Optional[int] = None, in_folder: bool = False, in_database: bool = False,
+                 stat: Optional[os.stat_result] = None):
+        """
+        :param notes: The zk.Notes that the card belongs to
+        :param created_ns: Creation time in the database, nanoseconds since epoch
+        :param modified_ns: Modification time in the folder if the card is open, otherwise in the database
+        :param stat: Stat data of the open card if it is already known
+        """
+        self.name = name
+        self.created_ns = created_ns
+        self.modified_ns = modified_ns
+        self.size = size
+        self.in_folder = in_folder
+        self.in_database = in_database
+        self._card = None
+        self._stat = stat
+        self._notes = notes
+
+    def __repr__(self) -> str:
+        location = '+'.join(place for place, present in (('folder', self.in_folder), ('database', self.in_database)) if present)
+        return f'Note({self.name!r}, {location})'
+
+    @property
+    def card(self) -> CardPath:
+        """ The parsed name, i.e. the major number, the parent, the depth and the sort key """
+        if self._card is None:
+            self._card = CN.parse(self.name)
+        return self._card
+
+    @property
+    def path(self) -> Optional[str]:
+        """ Path to the open card, or None if the card is not in the folder """
+        return self._notes.open_notes.fullpath_of_open_card(self.name) if self.in_folder else None
+
+    @property
+    def stat(self) -> Optional[os.stat_result]:
+        """ Stat data of the open card, or None if the card is not in the folder """
+        if self._stat is None and self.in_folder:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    def content(self) -> Optional[bytes]:
+        """ The content of the open card, or the saved content if the card is not open """
+        if self.in_folder:
+            with open(self.path, 'rb') as fd:
+                return fd.read()
+        return self._notes.persistent_notes.read_card(self.name)
+
+
+def iter_notes(notes, start_after: Optional[str] = None, page_size: int = PAGE_SIZE) -> Iterator[Note]:
+    """ Yield the cards of the folder and the database in natural order. The saved cards are read
+    a page at a time in the order of the sort key index and merged with the cards of the folder,
+    which are taken from the directory snapshot.
+    :param notes: zk.Notes
+    :param start_after: Start after this card, e.g. the last card of the previous page
+    """
+    if page_size < 1:
+        raise ValueError(f'Invalid page size: {page_size}')
+    after_key = ''
+    if start_after is not None:
+        after_card = CN.parse(start_after)
+        if after_card is None:
+            raise ValueError(f'Invalid card name: {start_after}')
+        after_key = after_card.sort_key
+    open_cards = sorted((entry for entry in notes.open_notes.open_card_entries() if entry.card and entry.card.sort_key > after_key),
+                        key=lambda entry: entry.card.sort_key)
+    stored_cards = _iter_stored_cards(notes.database_handle, after_key, page_size)
+
+    position = 0
+    for sort_key, name, created_ns, modified_ns, size in stored_cards:
+        while position < len(open_cards) and open_cards[position].card.sort_key < sort_key:
+            yield _open_note(notes, open_cards[position])
+            position += 1
+        if position < len(open_cards) and open_cards[position].name == name:
+            entry = open_cards[position]
+            position += 1
+            yield Note(notes, name, created_ns, entry.stat.st_mtime_ns, entry.stat.st_size,
+                       in_folder=True, in_database=True, stat=entry.stat)
+        else:
+            yield Note(notes, name, created_ns, modified_ns, size, in_database=True)
+    for entry in open_cards[position:]:
+        yield _open_note(notes, entry)
+
+
+def _open_note(notes, entry) -> Note:
+    return Note(notes, entry.name, None, entry.stat.st_mtime_ns, entry.stat.st_size, in_folder=True, stat=entry.stat)
+
+
+def _iter_stored_cards(database_handle, after_key: str, page_size: int) -> Iterator[Tuple[str, str, int, int, int]]:
+    """ Each page is a separate query that continues from the last sort key of the previous page """
+    while True:
+        cursor = database_handle.cursor()
+        cursor.execute('select sort_key, name, created_ns, modified_ns, size from notes where sort_key > ? '
+                       'order by sort_key limit ?', (after_key, page_size))
+        page = cursor.fetchall()
+        cursor.close()
+        yield from page
+        if len(page) < page_size:
+            break
+        after_key = page[-1][0]
@@ -1,15 +1,104 @@
 import os
 import re
+import time
 import sqlite3
 from typing import *
 
+import card_name as CN
+import profiling
+from card_name import CardPath
+import database_functions
+from database_functions import content_hash, content_text, content_header, content_links, file_content_hash
+
+
+SECONDS_TO_NANOSECONDS = 10**9
+
+# A file modified this close to the time its stat data was saved may change again within the
+# same clock tick of the file system, see is_unchanged_stat
+RACY_WINDOW_NS = SECONDS_TO_NANOSECONDS
+
+
+class StoredStat(NamedTuple):
+    """ Stat data of a card file at the time it was saved """
+    size: Optional[int]
+    mtime_ns: Optional[int]
+    content_hash: Optional[str]
+    saved_ns: Optional[int] = None  # When the stat data was saved
+
+
+class StoredBlob(NamedTuple):
+    """ Stored content of a card. The data is None for a large raw blob, which is read with copy_blob. """
+    codec: str
+    size: int
+    rowid: int
+    data: Optional[bytes]
+
+
+class StoredChange(NamedTuple):
+    """ Position of a card in the change log """
+    seq: Optional[int]
+    content_hash: str
+    mtime_ns: Optional[int]
+
+
 class NoteDatabase:
     IS_MAJOR_NUMBER = re.compile('^[0-9]+$')
     IS_ANY_NOTE = re.compile('^[0-9]+|[0-9]+[a-z]|[0-9]+([a-z][0-9]+)+')
 
-    def __init__(self, sqlite_connection: sqlite3.Connection):
-        """ Start using fully initialized database """
+    DEFAULT_BATCH_SIZE = 500
+    MAX_QUERY_PARAMETERS = 900
+    STREAMING_THRESHOLD = 2**20
+    STREAMING_CHUNK_SIZE = 2**16
+
+    _UPSERT_CARD = ('insert into notes(name, created_ns, modified_ns, content_hash, size, mtime_ns, saved_ns, '
+                    'major, parent, depth, sort_key, seq, origin, header_date, title, daily) '
+                    'values (:name, :created_ns, :modified_ns, :content_hash, :size, :mtime_ns, :saved_ns, '
+                    ':major, :parent, :depth, :sort_key, :seq, :origin, :header_date, :title, :daily) '
+                    'on conflict(name) do update set modified_ns=excluded.modified_ns, '
+                    'content_hash=excluded.content_hash, size=excluded.size, mtime_ns=excluded.mtime_ns, saved_ns=excluded.saved_ns, '
+                    'seq=excluded.seq, origin=excluded.origin, '
+                    'header_date=excluded.header_date, title=excluded.title, daily=excluded.daily')
+    _INSERT_BLOB = 'insert or ignore into blobs(hash, codec, size, data) values (?, ?, ?, ?)'
+    _DELETE_UNUSED_BLOB = ('delete from blobs where hash = ? and not exists (select 1 from notes where content_hash = blobs.hash) '
+                           "and not exists (select 1 from revisions where kind = 'blob' and content_hash = blobs.hash)")
+    _UPDATE_STAT = 'update notes set modified_ns = ?, mtime_ns = ?, saved_ns = ? where name = ?'
+    _DELETE_SEARCH_TEXT = 'delete from notes_fts where rowid = (select rowid from notes where name = :name)'
+    _INSERT_SEARCH_TEXT = 'insert into notes_fts(rowid, name, body) select rowid, name, :text from notes where name = :name'
+    _DELETE_LINKS = 'delete from links where src = ?'
+    _INSERT_LINK = 'insert or ignore into links(src, dst) values (?, ?)'
+    _DELETE_TAGS = 'delete from card_tags where name = ?'
+    _INSERT_TAG = 'insert or ignore into card_tags(tag, name) values (?, ?)'
+    _RAISE_LAST_MAJOR = 'update major_allocator set last_major = max(last_major, ?)'
+    _ALLOCATE_MAJOR = 'update major_allocator set last_major = max(last_major, ?) + 1 returning last_major'
+    _TAKE_SEQUENCE = 'update sync_counter set last_seq = last_seq + ? returning last_seq'
+    _SELECT_CHANGE = ('select name, created_ns, modified_ns, content_hash, notes.size, mtime_ns, seq, origin, codec, data '
+                      'from notes join blobs on blobs.hash = notes.content_hash ')
+
+    def __init__(self, sqlite_connection: sqlite3.Connection,
+                 codec: str = database_functions.DEFAULT_CODEC, level: int = database_functions.DEFAULT_LEVEL,
+                 streaming_threshold: Optional[int] = STREAMING_THRESHOLD, origin: Optional[str] = None):
+        """ Start using fully initialized database
+        :param codec: Compression of new card contents, one of database_functions.CODECS
+        :param level: Compression level of the codec
+        :param streaming_threshold: Cards of this size or larger are copied between the file and the
+            database in chunks through incremental blob I/O, and stored uncompressed. None to disable.
+        :param origin: Origin of the saved cards in the change log, the host name by default
+        """
+        if codec not in database_functions.CODECS:
+            raise ValueError(f'Unknown codec: {codec}')
         self._database_handle = sqlite_connection
+        self._codec = codec
+        self._level = level
+        self._origin = origin
+        # Connection.blobopen is new in Python 3.11
+        self._streaming_threshold = streaming_threshold if hasattr(sqlite_connection, 'blobopen') else None
+
+    def _is_streamed(self, size: Optional[int]) -> bool:
+        return self._streaming_threshold is not None and size is not None and size >= self._streaming_threshold
+
+    def is_streamed_blob(self, codec: str, size: Optional[int]) -> bool:
+        """ A raw blob this large is copied in chunks and only its beginning is indexed """
+        return codec == 'raw' and self._is_streamed(size)
 
     def commit(self):
         self._database_handle.commit()
@@ -42,29 +131,737 @@ class NoteDatabase:
 
 
     def save_card(self, card_name: str, card_path: str):
-        if not os.path.isfile(card_path):
-            raise EnvironmentError(f'Missing card: {card_path}')
+        self.save_cards([(card_name, card_path)])
+
+    def save_cards(self, cards: Iterable[Tuple[str, str]], batch_size: int = DEFAULT_BATCH_SIZE,
+                   progress: Optional[Callable[[int], None]] = None,
+                   stats: Optional[Mapping[str, os.stat_result]] = None) -> int:
+        """ Save many cards in a single transaction. The files are stat'ed `batch_size` cards
+        at a time and compared to the stored stat data. Only new and changed cards are read and
+        each batch is written with one executemany. Earlier saved versions of the cards, see
+        is_stale_file, are skipped.
+        :param cards: Pairs of (card name, path to the card file)
+        :param stats: Stat data of the cards if it is already known, e.g. from a directory snapshot
+        :param progress: Called with the number of cards checked so far after each batch
+        :return: Number of cards whose content was written
+        """
+        if batch_size < 1:
+            raise ValueError(f'Invalid batch size: {batch_size}')
+
+        checked = 0
+        saved = 0
+        origin = self._origin or hostname()
+        with profiling.phase('save'), self._database_handle:
+            cursor = self._database_handle.cursor()
+            for batch in _batches(cards, batch_size):
+                # Taken before the files are read, see is_unchanged_stat
+                saved_ns = time.time_ns()
+                stored_stats = self.stored_stats(card_name for card_name, _ in batch)
+                changed_rows = []
+                touched_rows = []
+                candidates = []
+                for card_name, card_path in batch:
+                    stat = stats.get(card_name) if stats else None
+                    if stat is None:
+                        stat = _stat_card(card_path)
+                    stored = stored_stats.get(card_name)
+                    if not (stored and is_unchanged_stat(stat, stored)):
+                        candidates.append((card_name, card_path, stat, stored))
+                older_hashes = self.revision_hashes(card_name for card_name, _, stat, stored in candidates
+                                                    if stored and is_older_file(stat, stored))
+                for card_name, card_path, stat, stored in candidates:
+                    revision_hashes = older_hashes.get(card_name)
+                    if self._is_streamed(stat.st_size):
+                        digest = None
+                        if stored and (stored.size == stat.st_size or revision_hashes):
+                            digest = file_content_hash(card_path)
+                        if digest is not None and digest == stored.content_hash:
+                            if _needs_stat_update(stat, stored, saved_ns):
+                                touched_rows.append((stat.st_mtime_ns, stat.st_mtime_ns, saved_ns, card_name))
+                        elif not (revision_hashes and is_stale_file(stat, stored, digest, revision_hashes)):
+                            changed_rows.append(self._save_streamed_card(cursor, card_name, card_path, stat))
+                        continue
+                    content = _read_card(card_path)
+                    digest = content_hash(content)
+                    if stored and digest == stored.content_hash:
+                        if _needs_stat_update(stat, stored, saved_ns):
+                            touched_rows.append((stat.st_mtime_ns, stat.st_mtime_ns, saved_ns, card_name))
+                    elif not (revision_hashes and is_stale_file(stat, stored, digest, revision_hashes)):
+                        changed_rows.append(_card_row(card_name, content, digest, stat))
+                for row in changed_rows:
+                    row.update(origin=origin, saved_ns=saved_ns)
+                self._insert_blobs(cursor, changed_rows)
+                self._write_cards(cursor, changed_rows, stored_stats)
+                cursor.executemany(NoteDatabase._UPDATE_STAT, touched_rows)
+                checked += len(batch)
+                saved += len(changed_rows)
+                if progress:
+                    progress(checked)
+            cursor.close()
+        return saved
 
+    def save_contents(self, contents: Iterable[Tuple[str, bytes]], batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+        """ Save new contents of cards that don't come from card files, e.g. from a script. Each batch
+        is written in its own transaction. The cards are saved as modified now, so a card file that
+        is open in the notes folder is older than the saved card: save skips it and unpack replaces it.
+        :param contents: Pairs of (card name, content)
+        :return: Number of cards whose content changed
+        """
+        origin = self._origin or hostname()
+        saved = 0
+        for batch in _batches(contents, batch_size):
+            with profiling.phase('save'), self._database_handle:
+                cursor = self._database_handle.cursor()
+                stored_stats = self.stored_stats(card_name for card_name, _ in batch)
+                now_ns = time.time_ns()
+                rows = []
+                for card_name, content in batch:
+                    digest = content_hash(content)
+                    stored = stored_stats.get(card_name)
+                    if stored and digest == stored.content_hash:
+                        continue
+                    row = _card_row(card_name, content, digest, None)
+                    row.update(created_ns=now_ns, modified_ns=now_ns, mtime_ns=now_ns, saved_ns=now_ns, origin=origin)
+                    rows.append(row)
+                self._insert_blobs(cursor, rows)
+                self._write_cards(cursor, rows, stored_stats)
+                cursor.close()
+            saved += len(rows)
+        return saved
+
+    def _write_cards(self, cursor: sqlite3.Cursor, rows: List[Dict[str, Any]], stored_stats: Dict[str, StoredStat]):
+        """ Write the changed cards into the notes table, the revisions, the search index, the links and
+        the tags. The metadata of the first line is parsed here. Each card takes the next sequence
+        number of the change log. The new contents have to be in the blobs table already, and the
+        blobs of the replaced contents are removed if nothing refers to them.
+        """
+        if not rows:
+            return
+        self._record_revisions(cursor, rows, stored_stats)
+        cursor.execute(NoteDatabase._TAKE_SEQUENCE, (len(rows),))
+        last_seq = cursor.fetchone()[0]
+        for seq, row in enumerate(rows, start=last_seq - len(rows) + 1):
+            row['seq'] = seq
+        headers = [content_header(row['content']) for row in rows]
+        for row, header in zip(rows, headers):
+            row.update(header_date=header.date, title=header.title, daily=int(header.daily))
+        cursor.executemany(NoteDatabase._UPSERT_CARD, rows)
+        self._update_search_index(cursor, rows)
+        self._update_links(cursor, rows)
+        cursor.executemany(NoteDatabase._DELETE_TAGS, [(row['name'],) for row in rows])
+        cursor.executemany(NoteDatabase._INSERT_TAG, [(tag, row['name']) for row, header in zip(rows, headers) for tag in header.tags])
+        replaced_hashes = set(stored_stats[row['name']].content_hash for row in rows if row['name'] in stored_stats)
+        cursor.executemany(NoteDatabase._DELETE_UNUSED_BLOB, [(digest,) for digest in replaced_hashes])
+        major_numbers = [row['major'] for row in rows if row['depth'] == 0]
+        if major_numbers:
+            cursor.execute(NoteDatabase._RAISE_LAST_MAJOR, (max(major_numbers),))
+
+    def revision_hashes(self, card_names: Iterable[str]) -> Dict[str, Set[str]]:
+        """ Return the content hashes of all saved revisions of the given cards """
+        hashes = {}
         cursor = self._database_handle.cursor()
-        stat = os.stat(card_path)
-        created_utc  = int(stat.st_ctime)
-        modified_utc = int(stat.st_mtime)
-        with open(card_path, 'rb') as fd:
-            content = fd.read()
-            sql1 = ('insert into notes(name, content, created_utc, modified_utc) values (?, ?, ?, ?)')
-            sql2 = ('on conflict(name) do update set content=excluded.content, modified_utc=excluded.modified_utc')
-            args = (card_name, content, created_utc, modified_utc)
+        for batch in _batches(card_names, NoteDatabase.MAX_QUERY_PARAMETERS):
+            placeholders = ', '.join('?' * len(batch))
+            cursor.execute(f'select name, content_hash from revisions where name in ({placeholders})', batch)
+            for card_name, digest in cursor:
+                hashes.setdefault(card_name, set()).add(digest)
+        cursor.close()
+        return hashes
+
+    def stale_files(self, files: Iterable[Tuple[str, str, os.stat_result]], stored_stats: Dict[str, StoredStat]) -> Set[str]:
+        """ Return the cards whose files are stale, see is_stale_file. Only the files that are older
+        than the saved cards are hashed.
+        :param files: Triples of (card name, path to the card file, stat data of the file)
+        """
+        older = [(card_name, card_path, stat) for card_name, card_path, stat in files
+                 if card_name in stored_stats and is_older_file(stat, stored_stats[card_name])]
+        older_hashes = self.revision_hashes(card_name for card_name, _, _ in older)
+        return set(card_name for card_name, card_path, stat in older
+                   if card_name in older_hashes and
+                   is_stale_file(stat, stored_stats[card_name], _file_hash(card_path), older_hashes[card_name]))
+
+    def stored_stats(self, card_names: Iterable[str]) -> Dict[str, StoredStat]:
+        """ Return the stat data saved with the given cards. Cards missing from the database are left out. """
+        card_names = list(card_names)
+        stats = {}
+        cursor = self._database_handle.cursor()
+        for batch in _batches(card_names, NoteDatabase.MAX_QUERY_PARAMETERS):
+            placeholders = ', '.join('?' * len(batch))
+            cursor.execute(f'select name, size, mtime_ns, content_hash, saved_ns from notes where name in ({placeholders})', batch)
+            for card_name, size, mtime_ns, stored_hash, saved_ns in cursor:
+                stats[card_name] = StoredStat(size, mtime_ns, stored_hash, saved_ns)
+        cursor.close()
+        return stats
+
+    def iter_stored_stats(self, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[Dict[str, StoredStat]]:
+        """ Yield the stored stat data of all cards in batches of `batch_size` cards """
+        cursor = self._database_handle.cursor()
+        cursor.execute('select name, size, mtime_ns, content_hash, saved_ns from notes')
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield {row[0]: StoredStat(*row[1:]) for row in rows}
+        cursor.close()
+
+    def read_blobs(self, card_names: Iterable[str]) -> Dict[str, StoredBlob]:
+        """ Return the stored contents of the given cards, see database_functions.decompress.
+        The data of large raw blobs isn't read, copy them with copy_blob. """
+        streaming_threshold = self._streaming_threshold if self._streaming_threshold is not None else 2**62
+        blobs = {}
+        cursor = self._database_handle.cursor()
+        for batch in _batches(card_names, NoteDatabase.MAX_QUERY_PARAMETERS):
+            placeholders = ', '.join('?' * len(batch))
+            cursor.execute(f"select name, codec, blobs.size, blobs.rowid, "
+                           f"case when codec = 'raw' and blobs.size >= ? then null else data end "
+                           f"from notes join blobs on blobs.hash = notes.content_hash where name in ({placeholders})",
+                           [streaming_threshold] + batch)
+            for card_name, codec, size, rowid, data in cursor:
+                blobs[card_name] = StoredBlob(codec, size, rowid, data)
+        cursor.close()
+        return blobs
+
+    def database_id(self) -> str:
+        """ Return the identifier of this database in the sync_state of other databases """
+        cursor = self._database_handle.cursor()
+        cursor.execute('select id from sync_identity')
+        database_id = cursor.fetchone()[0]
+        cursor.close()
+        return database_id
+
+    def last_sequence(self) -> int:
+        cursor = self._database_handle.cursor()
+        cursor.execute('select last_seq from sync_counter')
+        last_seq = cursor.fetchone()[0]
+        cursor.close()
+        return last_seq
+
+    def sync_state(self, peer: str) -> Tuple[int, int]:
+        """ Return the last sequence number received from the peer database and the last sequence
+        number of this database sent to it, or zeros if the databases haven't been synced """
+        cursor = self._database_handle.cursor()
+        cursor.execute('select pulled_seq, pushed_seq from sync_state where peer = ?', (peer,))
+        state = cursor.fetchone()
+        cursor.close()
+        return tuple(state) if state else (0, 0)
+
+    def set_sync_state(self, peer: str, pulled_seq: int, pushed_seq: int):
+        """ Doesn't commit """
+        self._database_handle.execute('insert into sync_state(peer, pulled_seq, pushed_seq) values (?, ?, ?) '
+                                      'on conflict(peer) do update set pulled_seq=excluded.pulled_seq, pushed_seq=excluded.pushed_seq',
+                                      (peer, pulled_seq, pushed_seq))
+
+    def iter_changes(self, since_seq: int, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[List[Dict[str, Any]]]:
+        """ Yield the cards written after the sequence number in batches, in the order they were written.
+        The contents are the stored blobs, see database_functions.decompress. """
+        cursor = self._database_handle.cursor()
+        cursor.execute(NoteDatabase._SELECT_CHANGE + 'where seq > ? order by seq', (since_seq,))
+        columns = [column[0] for column in cursor.description]
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [dict(zip(columns, row)) for row in rows]
+        cursor.close()
+
+    def read_change(self, card_name: str) -> Optional[Dict[str, Any]]:
+        """ Return the card as iter_changes does, or None if the card is not in the database """
+        cursor = self._database_handle.cursor()
+        cursor.execute(NoteDatabase._SELECT_CHANGE + 'where name = ?', (card_name,))
+        columns = [column[0] for column in cursor.description]
+        row = cursor.fetchone()
+        cursor.close()
+        return dict(zip(columns, row)) if row else None
+
+    def stored_changes(self, card_names: Iterable[str]) -> Dict[str, StoredChange]:
+        """ Return the change log position of the given cards. Cards missing from the database are left out. """
+        changes = {}
+        cursor = self._database_handle.cursor()
+        for batch in _batches(card_names, NoteDatabase.MAX_QUERY_PARAMETERS):
+            placeholders = ', '.join('?' * len(batch))
+            cursor.execute(f'select name, seq, content_hash, mtime_ns from notes where name in ({placeholders})', batch)
+            for card_name, seq, stored_hash, mtime_ns in cursor:
+                changes[card_name] = StoredChange(seq, stored_hash, mtime_ns)
+        cursor.close()
+        return changes
+
+    def save_synced_cards(self, changes: List[Dict[str, Any]]):
+        """ Write cards from iter_changes of another database. The cards keep their origin and take
+        the next sequence numbers of this database. Doesn't commit. """
+        cursor = self._database_handle.cursor()
+        for batch in _batches(changes, NoteDatabase.DEFAULT_BATCH_SIZE):
+            saved_ns = time.time_ns()
+            stored_stats = self.stored_stats(change['name'] for change in batch)
+            cursor.executemany(NoteDatabase._INSERT_BLOB, [(change['content_hash'], change['codec'], change['size'], change['data'])
+                                                           for change in batch])
+            rows = []
+            for change in batch:
+                card = CN.parse(change['name'])
+                streamed = self.is_streamed_blob(change['codec'], change['size'])
+                if streamed:
+                    content = change['data'][:self._streaming_threshold]
+                else:
+                    content = database_functions.decompress(change['codec'], change['data'])
+                rows.append({
+                    'name': change['name'],
+                    'content': content,
+                    'streamed': streamed,
+                    'created_ns': change['created_ns'],
+                    'modified_ns': change['modified_ns'],
+                    'content_hash': change['content_hash'],
+                    'size': change['size'],
+                    'mtime_ns': change['mtime_ns'],
+                    'saved_ns': saved_ns,
+                    'major': card.major if card else None,
+                    'parent': card.parent if card else None,
+                    'depth': card.depth if card else None,
+                    'sort_key': card.sort_key if card else None,
+                    'origin': change['origin'],
+                })
+            self._write_cards(cursor, rows, stored_stats)
+        cursor.close()
+
+    def _save_streamed_card(self, cursor: sqlite3.Cursor, card_name: str, card_path: str, stat: os.stat_result) -> Dict[str, Any]:
+        """ Copy a large card into the blobs table in chunks. The file is read once: the content is
+        hashed while it's written into a blob with a temporary key, and the blob is dropped afterwards
+        if the same content is already stored.
+        :return: A row for the notes table. Only the beginning of the content is included, for the full-text index.
+        """
+        import hashlib
+        size = stat.st_size
+        cursor.execute('insert into blobs(hash, codec, size, data) values (?, ?, ?, zeroblob(?)) returning rowid',
+                       (f'partial:{card_name}', 'raw', size, size))
+        rowid = cursor.fetchone()[0]
+
+        hasher = hashlib.sha256()
+        beginning = bytearray()
+        buffer = memoryview(bytearray(NoteDatabase.STREAMING_CHUNK_SIZE))
+        with open(card_path, 'rb') as fd, self._database_handle.blobopen('blobs', 'data', rowid) as blob:
+            remaining = size
+            while remaining > 0:
+                length = fd.readinto(buffer[:min(remaining, len(buffer))])
+                if not length:
+                    raise EnvironmentError(f'Card changed while saving: {card_path}')
+                chunk = buffer[:length]
+                hasher.update(chunk)
+                blob.write(chunk)
+                if len(beginning) < self._streaming_threshold:
+                    beginning += chunk[:self._streaming_threshold - len(beginning)]
+                remaining -= length
+            if fd.read(1):
+                raise EnvironmentError(f'Card changed while saving: {card_path}')
+
+        digest = hasher.hexdigest()
+        cursor.execute('select 1 from blobs where hash = ?', (digest,))
+        if cursor.fetchone():
+            cursor.execute('delete from blobs where rowid = ?', (rowid,))
+        else:
+            cursor.execute('update blobs set hash = ? where rowid = ?', (digest, rowid))
+
+        row = _card_row(card_name, bytes(beginning), digest, stat)
+        row['size'] = size
+        row['streamed'] = True
+        return row
+
+    def copy_blob_from(self, digest: str, size: int, fd: BinaryIO) -> bytes:
+        """ Read `size` bytes from the file into a raw blob in chunks, unless the blob is stored
+        already. The content has to match the hash. Doesn't commit.
+        :return: The beginning of the content, for the full-text index and the links
+        """
+        import hashlib
+        cursor = self._database_handle.cursor()
+        cursor.execute('select 1 from blobs where hash = ?', (digest,))
+        if cursor.fetchone():
+            cursor.close()
+            beginning = fd.read(min(size, self._streaming_threshold))
+            fd.seek(size - len(beginning), os.SEEK_CUR)
+            return beginning
+        cursor.execute('insert into blobs(hash, codec, size, data) values (?, ?, ?, zeroblob(?)) returning rowid',
+                       (digest, 'raw', size, size))
+        rowid = cursor.fetchone()[0]
+
+        hasher = hashlib.sha256()
+        beginning = bytearray()
+        with self._database_handle.blobopen('blobs', 'data', rowid) as blob:
+            remaining = size
+            while remaining > 0:
+                chunk = fd.read(min(remaining, NoteDatabase.STREAMING_CHUNK_SIZE))
+                if not chunk:
+                    raise EnvironmentError(f'Unexpected end of file in the content of {digest}')
+                hasher.update(chunk)
+                blob.write(chunk)
+                if len(beginning) < self._streaming_threshold:
+                    beginning += chunk[:self._streaming_threshold - len(beginning)]
+                remaining -= len(chunk)
+        if hasher.hexdigest() != digest:
+            cursor.execute('delete from blobs where rowid = ?', (rowid,))
+            cursor.close()
+            raise ValueError(f'The content does not match its hash {digest}')
+        cursor.close()
+        return bytes(beginning)
+
+    def copy_blob(self, rowid: int, fd: BinaryIO):
+        """ Write a raw blob into a file in chunks """
+        with self._database_handle.blobopen('blobs', 'data', rowid, readonly=True) as blob:
+            while True:
+                chunk = blob.read(NoteDatabase.STREAMING_CHUNK_SIZE)
+                if not chunk:
+                    break
+                fd.write(chunk)
+
+    def _insert_blobs(self, cursor: sqlite3.Cursor, rows: List[Dict[str, Any]]):
+        """ Compress and store the contents that aren't in the blobs table yet """
+        new_contents = {row['content_hash']: row['content'] for row in rows if not row.get('streamed')}
+        for batch in _batches(list(new_contents), NoteDatabase.MAX_QUERY_PARAMETERS):
+            placeholders = ', '.join('?' * len(batch))
+            cursor.execute(f'select hash from blobs where hash in ({placeholders})', batch)
+            for stored_hash, in cursor.fetchall():
+                del new_contents[stored_hash]
+        blob_rows = []
+        for digest, content in new_contents.items():
+            codec, data = database_functions.compress(content, self._codec, self._level)
+            blob_rows.append((digest, codec, len(content), data))
+        cursor.executemany(NoteDatabase._INSERT_BLOB, blob_rows)
+
+    def _record_revisions(self, cursor: sqlite3.Cursor, rows: List[Dict[str, Any]], stored_stats: Dict[str, StoredStat]):
+        """ Add a revision of the changed cards. The previous content is read before the blobs are replaced. """
+        import revisions
+        changes = []
+        for row in rows:
+            stored = stored_stats.get(row['name'])
+            previous_content = None
+            if stored and not self._is_streamed(stored.size):
+                previous_content = self._read_blob(cursor, stored.content_hash)
+            content = None if row.get('streamed') else row['content']
+            modified_utc = row['modified_ns'] // SECONDS_TO_NANOSECONDS
+            changes.append(revisions.Change(row['name'], previous_content, content, row['content_hash'], row['size'], modified_utc))
+        revisions.record_revisions(cursor, changes)
+
+    def _read_blob(self, cursor: sqlite3.Cursor, digest: str) -> Optional[bytes]:
+        cursor.execute('select codec, data from blobs where hash = ?', (digest,))
+        blob_row = cursor.fetchone()
+        return database_functions.decompress(*blob_row) if blob_row else None
+
+    def read_card(self, card_name: str) -> Optional[bytes]:
+        """ Return the content of a card or None if the card is not in the database """
+        cursor = self._database_handle.cursor()
+        cursor.execute('select codec, data from notes join blobs on blobs.hash = notes.content_hash where name = ?', (card_name,))
+        blob_row = cursor.fetchone()
+        cursor.close()
+        if not blob_row:
+            return None
+        return database_functions.decompress(*blob_row)
+
+    def iter_cards(self) -> Iterator[Tuple[str, bytes, int, int]]:
+        """ Yield the name, content, created and modified time of every card. The times are nanoseconds since epoch. """
+        cursor = self._database_handle.cursor()
+        cursor.execute('select name, codec, data, created_ns, modified_ns from notes join blobs on blobs.hash = notes.content_hash')
+        for card_name, codec, data, created_ns, modified_ns in cursor:
+            yield card_name, database_functions.decompress(codec, data), created_ns, modified_ns
+        cursor.close()
+
+    def _update_search_index(self, cursor: sqlite3.Cursor, rows: List[Dict[str, Any]]):
+        """ Replace the full-text index entries of the saved cards """
+        search_rows = [{'name': row['name'], 'text': content_text(row['content'])} for row in rows]
+        cursor.executemany(NoteDatabase._DELETE_SEARCH_TEXT, search_rows)
+        cursor.executemany(NoteDatabase._INSERT_SEARCH_TEXT, search_rows)
+
+    def _update_links(self, cursor: sqlite3.Cursor, rows: List[Dict[str, Any]]):
+        """ Replace the links of the saved cards. Only the beginning of a streamed card is searched for links. """
+        cursor.executemany(NoteDatabase._DELETE_LINKS, [(row['name'],) for row in rows])
+        cursor.executemany(NoteDatabase._INSERT_LINK, [(row['name'], link) for row in rows
+                                                       for link in content_links(row['content']) if link != row['name']])
+
+    def rebuild_search_index(self):
+        """ Index the contents of all cards again, e.g. after the rowids have been changed by vacuum
+        @Robustness: Needs the functions of database_functions registered to the connection
+        """
+        with self._database_handle:
+            cursor = self._database_handle.cursor()
+            cursor.execute('delete from notes_fts')
+            cursor.execute('insert into notes_fts(rowid, name, body) select notes.rowid, name, zk_text(zk_decompress(codec, data)) '
+                           'from notes join blobs on blobs.hash = notes.content_hash')
+            cursor.close()
+
+    def search(self, query: str, limit: int = 20) -> List[Tuple[str, str]]:
+        """ Return names and snippets of the cards that match the full-text query, best match first.
+        The query uses the FTS5 syntax. If it is not a valid FTS5 query, each word is searched as is.
+        """
+        sql = ("select name, snippet(notes_fts, 1, '[', ']', '...', 12) from notes_fts "
+               "where notes_fts match ? order by rank limit ?")
+        cursor = self._database_handle.cursor()
+        try:
+            cursor.execute(sql, (query, limit))
+        except sqlite3.OperationalError:
+            quoted_query = ' '.join('"' + word.replace('"', '""') + '"' for word in query.split())
+            cursor.execute(sql, (quoted_query, limit))
+        results = cursor.fetchall()
+        cursor.close()
+        return results
+
+    def rebuild_links(self):
+        """ Parse the links of all cards again
+        @Robustness: Needs the functions of database_functions registered to the connection
+        """
+        with self._database_handle:
+            cursor = self._database_handle.cursor()
+            cursor.execute('delete from links')
+            cursor.execute('insert or ignore into links(src, dst) '
+                           'select notes.name, json_each.value from notes join blobs on blobs.hash = notes.content_hash, '
+                           'json_each(zk_links(zk_decompress(codec, data))) where json_each.value <> notes.name')
+            cursor.close()
+
+    def links(self, card_name: str) -> List[str]:
+        """ Return the names of the cards that the card refers to """
+        cursor = self._database_handle.cursor()
+        cursor.execute('select dst from links where src = ?', (card_name,))
+        results = [row[0] for row in cursor]
+        cursor.close()
+        return results
+
+    def backlinks(self, card_name: str) -> List[str]:
+        """ Return the names of the cards that refer to the card """
+        cursor = self._database_handle.cursor()
+        cursor.execute('select src from links where dst = ?', (card_name,))
+        results = [row[0] for row in cursor]
+        cursor.close()
+        return results
 
-            cursor.execute(' '.join((sql1, sql2)), args)
+    def neighbourhood(self, card_name: str, hops: int) -> Dict[str, int]:
+        """ Return the cards that are at most `hops` links away from the card in either direction,
+        with their distance. The links are followed breadth first, with one query per hop and direction. """
+        distances = {card_name: 0}
+        frontier = [card_name]
+        cursor = self._database_handle.cursor()
+        for distance in range(1, hops + 1):
+            reached = []
+            for batch in _batches(frontier, NoteDatabase.MAX_QUERY_PARAMETERS // 2):
+                placeholders = ', '.join('?' * len(batch))
+                cursor.execute(f'select dst from links where src in ({placeholders}) '
+                               f'union select src from links where dst in ({placeholders})', batch + batch)
+                for neighbour, in cursor:
+                    if neighbour not in distances:
+                        distances[neighbour] = distance
+                        reached.append(neighbour)
+            if not reached:
+                break
+            frontier = reached
+        cursor.close()
+        return distances
 
-        self.commit()
+    def links_between(self, card_names: Iterable[str]) -> List[Tuple[str, str]]:
+        """ Return the links whose both ends are in the given cards """
+        card_names = set(card_names)
+        edges = []
+        cursor = self._database_handle.cursor()
+        for batch in _batches(card_names, NoteDatabase.MAX_QUERY_PARAMETERS):
+            placeholders = ', '.join('?' * len(batch))
+            cursor.execute(f'select src, dst from links where src in ({placeholders})', batch)
+            edges.extend((src, dst) for src, dst in cursor if dst in card_names)
+        cursor.close()
+        return edges
+
+    def cards_of_date(self, date: str) -> List[str]:
+        """ Return the cards whose first line starts with the date, YYYY-MM-DD """
+        cursor = self._database_handle.cursor()
+        cursor.execute('select name from notes where header_date = ? order by sort_key', (date,))
+        results = [row[0] for row in cursor]
+        cursor.close()
+        return results
+
+    def cards_with_tag(self, tag: str) -> List[str]:
+        """ Return the cards that have the #tag on their first line """
+        cursor = self._database_handle.cursor()
+        cursor.execute('select name from card_tags join notes using (name) where tag = ? order by sort_key', (tag,))
+        results = [row[0] for row in cursor]
+        cursor.close()
+        return results
+
+    def allocate_major_number(self, minimum: int = 0, cursor: Optional[sqlite3.Cursor] = None) -> int:
+        """ Reserve the next major card number. It is larger than any number handed out before
+        and larger than `minimum`, e.g. the largest major card that exists only on disk.
+        The write lock is taken before reading, so concurrent processes get different numbers.
+        :param cursor: Allocate in the caller's transaction, which has been started with BEGIN IMMEDIATE.
+            The caller commits.
+        """
+        if cursor is not None:
+            cursor.execute(NoteDatabase._ALLOCATE_MAJOR, (minimum,))
+            return int(cursor.fetchone()[0])
+
+        with profiling.phase('allocation'):
+            cursor = self._database_handle.cursor()
+            try:
+                cursor.execute('begin immediate')
+                cursor.execute(NoteDatabase._ALLOCATE_MAJOR, (minimum,))
+                major_number = int(cursor.fetchone()[0])
+                self.commit()
+            except:
+                self._database_handle.rollback()
+                raise
+            finally:
+                cursor.close()
+        return major_number
+
+    def last_child(self, card: CardPath) -> Optional[CardPath]:
+        """ Return the last branch of the card in natural order """
+        cursor = self._database_handle.cursor()
+        cursor.execute('select name from notes where parent = ? order by sort_key desc limit 1', (card.name,))
+        child_row = cursor.fetchone()
+        cursor.close()
+        return CN.parse(child_row[0]) if child_row else None
+
+    def find_children(self, card: CardPath) -> List[str]:
+        """ Return the direct branches of the card in natural order """
+        cursor = self._database_handle.cursor()
+        cursor.execute('select name from notes where parent = ? order by sort_key', (card.name,))
+        children = [row[0] for row in cursor]
+        cursor.close()
+        return children
+
+    def find_descendants(self, card: CardPath) -> List[str]:
+        """ Return all branches of the card, and their branches, in natural order """
+        cursor = self._database_handle.cursor()
+        cursor.execute('select name from notes where sort_key >= ? and sort_key < ? order by sort_key', CN.descendant_range(card))
+        descendants = [row[0] for row in cursor]
+        cursor.close()
+        return descendants
 
     def card_modified_utc_time_in_seconds(self, card_name: str) -> Optional[int]:
         cursor = self._database_handle.cursor()
-        cursor.execute('select modified_utc from notes where name = ?', (card_name,))
+        cursor.execute('select modified_ns from notes where name = ?', (card_name,))
         modified_time = cursor.fetchone()
         cursor.close()
 
-        if not modified_time:
+        if not modified_time or modified_time[0] is None:
             return None
-        return int(modified_time[0])
+        return modified_time[0] // SECONDS_TO_NANOSECONDS
+
+    def iter_recent_cards(self, since_ns: Optional[int] = None, page_size: int = DEFAULT_BATCH_SIZE) -> Iterator[Tuple[str, int, Optional[str]]]:
+        """ Yield the name, modification time and title of the cards, the most recently modified first.
+        The cards are read a page at a time in the order of the notes_modified index, each page
+        continuing from the last card of the previous one.
+        :param since_ns: Stop at the cards modified before this time, nanoseconds since epoch
+        """
+        cursor = self._database_handle.cursor()
+        since_ns = since_ns if since_ns is not None else -1
+        cursor.execute('select name, modified_ns, title from notes where modified_ns >= ? '
+                       'order by modified_ns desc, name desc limit ?', (since_ns, page_size))
+        while True:
+            page = cursor.fetchall()
+            yield from page
+            if len(page) < page_size:
+                break
+            last_name, last_modified_ns, _ = page[-1]
+            cursor.execute('select name, modified_ns, title from notes where modified_ns >= ? and (modified_ns, name) < (?, ?) '
+                           'order by modified_ns desc, name desc limit ?', (since_ns, last_modified_ns, last_name, page_size))
+        cursor.close()
+
+
+def hostname() -> str:
+    if hasattr(os, 'uname'):
+        return os.uname().nodename
+    import socket
+    return socket.gethostname()
+
+
+def _batches(items: Iterable, batch_size: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def is_unchanged_stat(stat: os.stat_result, stored: StoredStat) -> bool:
+    """ Return True when the stat data of a card file proves that it hasn't changed since it was
+    saved: the size and the modification time are the saved ones, and the file was modified
+    clearly before the stat data was saved. A file modified within RACY_WINDOW_NS of the save
+    could have been changed again without changing its modification time, e.g. on a file system
+    with whole-second times, so it's ambiguous and has to be hashed.
+    """
+    if stored.mtime_ns is None or stored.saved_ns is None:
+        return False
+    if stored.size != stat.st_size or stored.mtime_ns != stat.st_mtime_ns:
+        return False
+    return _is_clearly_before(stat.st_mtime_ns, stored.saved_ns)
+
+
+def _is_clearly_before(mtime_ns: int, saved_ns: int) -> bool:
+    return mtime_ns < saved_ns - RACY_WINDOW_NS
+
+
+def _needs_stat_update(stat: os.stat_result, stored: StoredStat, saved_ns: int) -> bool:
+    """ An ambiguous card whose content hasn't changed needs new stat data only if the stat data
+    differs, or if saving it again makes the card unambiguous """
+    if stored.size != stat.st_size or stored.mtime_ns != stat.st_mtime_ns:
+        return True
+    return _is_clearly_before(stat.st_mtime_ns, saved_ns)
+
+
+def is_older_file(stat: os.stat_result, stored: StoredStat) -> bool:
+    """ Return True when the card was written into the database after the file was last modified """
+    return stored.mtime_ns is not None and stat.st_mtime_ns < stored.mtime_ns
+
+
+def is_stale_file(stat: os.stat_result, stored: StoredStat, digest: Optional[str], revision_hashes: Set[str]) -> bool:
+    """ Return True when the file is an earlier saved version of the card, e.g. after a script saved
+    the card, so save skips it and unpack replaces it. The file must be older than the saved card
+    and have the content of one of its revisions. An older file with other content is an edit
+    that was never saved, e.g. from a host whose clock is ahead, and is modified.
+    :param digest: Content hash of the file
+    :param revision_hashes: Content hashes of the saved revisions of the card, see NoteDatabase.revision_hashes
+    """
+    return is_older_file(stat, stored) and digest != stored.content_hash and digest in revision_hashes
+
+
+def _file_hash(card_path: str) -> Optional[str]:
+    try:
+        return file_content_hash(card_path)
+    except FileNotFoundError:
+        return None
+
+
+def is_modified_card(card_path: str, stat: os.stat_result, stored: StoredStat) -> bool:
+    """ Compare a card file to its stored stat data. The file is hashed only when the stat data is ambiguous. """
+    if stored.size is not None and stored.size != stat.st_size:
+        return True
+    if is_unchanged_stat(stat, stored):
+        return False
+    return file_content_hash(card_path) != stored.content_hash
+
+
+def _stat_card(card_path: str) -> os.stat_result:
+    try:
+        return os.stat(card_path)
+    except FileNotFoundError:
+        raise EnvironmentError(f'Missing card: {card_path}')
+
+
+def _read_card(card_path: str) -> bytes:
+    try:
+        with open(card_path, 'rb') as fd:
+            return fd.read()
+    except FileNotFoundError:
+        raise EnvironmentError(f'Missing card: {card_path}')
+
+
+def _card_row(card_name: str, content: bytes, digest: str, stat: Optional[os.stat_result]) -> Dict[str, Any]:
+    """ Return a row for the notes table. The content is used only for the blobs, revisions and full-text index.
+    Without the stat data of a card file the times are left empty. """
+    card = CN.parse(card_name)
+    return {
+        'name': card_name,
+        'content': content,
+        'created_ns': stat.st_ctime_ns if stat else None,
+        'modified_ns': stat.st_mtime_ns if stat else None,
+        'content_hash': digest,
+        'size': len(content),
+        'mtime_ns': stat.st_mtime_ns if stat else None,
+        'major': card.major if card else None,
+        'parent': card.parent if card else None,
+        'depth': card.depth if card else None,
+        'sort_key': card.sort_key if card else None,
+    }
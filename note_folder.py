@@ -1,30 +1,111 @@
 import os
 import re
 import sys
-import glob
 import time
 import sqlite3
 from typing import *
 
+import card_name as CN
+import profiling
+import note_database
+from card_name import CardPath
+from note_database import NoteDatabase
+
 
 SECONDS_TO_NANOSECONDS = 10**9
 
+IS_MAJOR_NUMBER = re.compile('^[0-9]+$')
+IS_ANY_NOTE = re.compile('^[0-9]+|[0-9]+[a-z]|[0-9]+([a-z][0-9]+)+')
+
+MAJOR_CARD = 'major'
+BRANCH_CARD = 'branch'
+
+# Status of a card in the folder compared to the database, see card_status
+NEW = 'new'
+MODIFIED = 'modified'
+DELETED = 'deleted'
+UNCHANGED = 'unchanged'
+STALE = 'stale'          # The file is an earlier saved version of the card, see note_database.is_stale_file
+
+
+def card_kind(file_name: str) -> Optional[str]:
+    """ Return MAJOR_CARD, BRANCH_CARD or None if the file is not a card """
+    if IS_MAJOR_NUMBER.match(file_name):
+        return MAJOR_CARD
+    if IS_ANY_NOTE.match(file_name):
+        return BRANCH_CARD
+    return None
+
+
+class DirectoryEntry(NamedTuple):
+    name: str
+    kind: Optional[str]
+    stat: os.stat_result
+    card: Optional[CardPath]
+
+
+class DirectorySnapshot:
+    """ Names, card kinds and stat data of the files in the notes directory, read with a single scan.
+    The stat data is from the time of the scan.
+    """
+    RACY_WINDOW_NS = SECONDS_TO_NANOSECONDS
+
+    def __init__(self, directory: str):
+        self.scanned_ns = time.time_ns()
+        self.directory_mtime_ns = os.stat(directory).st_mtime_ns
+        self.entries: Dict[str, DirectoryEntry] = {}
+        with os.scandir(directory) as scan:
+            for entry in scan:
+                if entry.name.startswith('.') or not entry.is_file():
+                    continue
+                self.entries[entry.name] = DirectoryEntry(entry.name, card_kind(entry.name), entry.stat(), CN.parse(entry.name))
+
+    def is_current(self, directory: str) -> bool:
+        """ The snapshot is current if no file has been added, removed or renamed since the scan.
+        The directory must have been modified clearly before the scan, because the file system
+        may not update the directory mtime for changes that happen within the same clock tick.
+        """
+        directory_mtime_ns = os.stat(directory).st_mtime_ns
+        if directory_mtime_ns != self.directory_mtime_ns:
+            return False
+        return self.scanned_ns - directory_mtime_ns > DirectorySnapshot.RACY_WINDOW_NS
+
+    def cards(self, kind: Optional[str] = None) -> Iterator[DirectoryEntry]:
+        """ Return the cards in the snapshot, optionally only cards of given kind """
+        for entry in self.entries.values():
+            if entry.kind is not None and (kind is None or entry.kind == kind):
+                yield entry
+
+
 class NotesDirectory:
     def __init__(self, directory: str):
         if not os.path.isdir(directory):
             raise EnvironmentError(f'Missing directory: {directory}')
         self._directory = directory
+        self._snapshot: Optional[DirectorySnapshot] = None
+
+    def snapshot(self, fresh_stats: bool = False) -> DirectorySnapshot:
+        """ Return the snapshot of the directory. The previous snapshot is reused for its names and
+        card kinds if the directory hasn't changed since. Editing a file in place doesn't change the
+        directory, so its stat data may be old: `fresh_stats` scans the directory again. """
+        if fresh_stats or self._snapshot is None or not self._snapshot.is_current(self._directory):
+            with profiling.phase('directory scan'):
+                self._snapshot = DirectorySnapshot(self._directory)
+        return self._snapshot
+
+    def invalidate(self):
+        """ Forget the snapshot, e.g. after writing into the directory or when fresh stat data is needed """
+        self._snapshot = None
 
     def list_open_note_files(self) -> Set[str]:
         ''' Return full path to files in the directory. It can contain more files than
         in the database if the user created them. '''
-        match = os.path.join(self._directory, '*')
-        return set(glob.glob(match))
+        return set(os.path.join(self._directory, name) for name in self.snapshot().entries)
 
 
 class NoteFiles:
-    IS_MAJOR_NUMBER = re.compile('^[0-9]+$')
-    IS_ANY_NOTE = re.compile('^[0-9]+|[0-9]+[a-z]|[0-9]+([a-z][0-9]+)+')
+    IS_MAJOR_NUMBER = IS_MAJOR_NUMBER
+    IS_ANY_NOTE = IS_ANY_NOTE
 
     def __init__(self, directory: NotesDirectory):
         self._directory = directory
@@ -35,21 +116,28 @@ class NoteFiles:
 
     def find_major_notes(self) -> Set[str]:
         """ Return major note names in the directory (e.g. 123, 124). """
-        notes = set()
-        for file in self._directory.list_open_note_files():
-            file = os.path.basename(file)
-            if NoteFiles.IS_MAJOR_NUMBER.match(file):
-                notes.add(file)
-        return notes
+        return set(entry.name for entry in self._directory.snapshot().cards(MAJOR_CARD))
 
     def find_all_notes(self) -> Set[str]:
         """ Return all note names in the directory (e.g. 123, 123a1) """
-        notes = set()
-        for file in self._directory.list_open_note_files():
-            file = os.path.basename(file)
-            if NoteFiles.IS_ANY_NOTE.match(file):
-                notes.add(file)
-        return notes
+        return set(entry.name for entry in self._directory.snapshot().cards())
+
+    def last_child(self, card: CardPath) -> Optional[CardPath]:
+        """ Return the last branch of the card in the directory in natural order """
+        children = [entry.card for entry in self._directory.snapshot().cards() if entry.card and entry.card.parent == card.name]
+        return max(children, key=lambda child: child.sort_key, default=None)
+
+    def invalidate(self):
+        """ Forget the listing of the directory after writing cards with write_card """
+        self._directory.invalidate()
+
+    def stat_of_open_cards(self) -> Dict[str, os.stat_result]:
+        """ Return the current stat data of all cards in the directory, read with a new scan """
+        return {entry.name: entry.stat for entry in self._directory.snapshot(fresh_stats=True).cards()}
+
+    def open_card_entries(self) -> Iterator[DirectoryEntry]:
+        """ Return the cards in the directory with their current stat data, read with a new scan """
+        return self._directory.snapshot(fresh_stats=True).cards()
 
     def create_card_with_modified_time(self, card_name: str, content: str, modified_utc: int):
         """ Open an existing card from the database and set correct access and modified time """
@@ -60,6 +148,30 @@ class NoteFiles:
         modified_utc_ns = int(modified_utc * seconds_to_nanoseconds)
         os.utime(card_path, times=None, ns=(access_utc_ns, modified_utc_ns), follow_symlinks=True)
 
+    def write_card(self, card_name: str, content: Union[bytes, Callable[[BinaryIO], None]], modified_ns: Optional[int]) -> str:
+        """ Write a card from the database, replacing an existing file, and set its modification time.
+        The file is replaced atomically. It's safe to write different cards from several threads.
+        :param content: The content or a function that writes the content into the file
+        :param modified_ns: Modification time of the file, or None to leave it at the current time
+        :return: Filepath to the card
+        """
+        card_path = self.fullpath_of_open_card(card_name)
+        temporary_path = os.path.join(self._directory._directory, f'.{card_name}.unpack')
+        try:
+            with open(temporary_path, 'wb') as fd:
+                if callable(content):
+                    content(fd)
+                else:
+                    fd.write(content)
+            if modified_ns is not None:
+                os.utime(temporary_path, ns=(time.time_ns(), modified_ns))
+            os.replace(temporary_path, card_path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.unlink(temporary_path)
+            raise
+        return card_path
+
     def create_new_card(self, card_name: str, content: Union[str, bytes]) -> str:
         """ Create a new card
         :return: Filepath to the new card
@@ -75,30 +187,42 @@ class NoteFiles:
             else:
                 fd.write(content)
 
+        self._directory.invalidate()
         return card_path
 
 
-def modified_cards(note_files: NoteFiles, database_handle: sqlite3.Connection):
-    """ @Robustness: Exception safety """
-    open_cards = note_files.find_all_notes()
-
-    cursor = database_handle.cursor()
-    cursor.execute('select name, modified_utc from notes')
-    list_of_names_and_mtimes = cursor.fetchall()
-    cursor.close()
-
-    modified = set()
-    for card_name, mtime in list_of_names_and_mtimes:
-        mtime = int(mtime)
-        if card_name in open_cards:
-            card_path = note_files.fullpath_of_open_card(card_name)
-            card_mtime_ns = os.stat(card_path).st_mtime_ns  # card_modified_utc_time_in_seconds(...)
-            note_mtime_ns = mtime * SECONDS_TO_NANOSECONDS
+def card_status(note_files: NoteFiles, database_handle: sqlite3.Connection) -> Dict[str, str]:
+    """ Classify every card in the folder or in the database as NEW, MODIFIED, DELETED, STALE or UNCHANGED.
+    The folder is scanned once and the stored stat data is read with one query, whose rows are
+    matched to the scanned cards as they are fetched. Cards are hashed only when their stat
+    data is ambiguous.
+    @Robustness: Exception safety
+    """
+    open_cards = note_files.stat_of_open_cards()
+    store = NoteDatabase(database_handle)
+    status = {}
+    for stored_stats in store.iter_stored_stats():
+        stale_files = store.stale_files(((card_name, note_files.fullpath_of_open_card(card_name), open_cards[card_name])
+                                         for card_name in stored_stats if card_name in open_cards), stored_stats)
+        for card_name, stored in stored_stats.items():
+            stat = open_cards.get(card_name)
+            if stat is None:
+                status[card_name] = DELETED
+            elif card_name in stale_files:
+                status[card_name] = STALE
+            elif note_database.is_modified_card(note_files.fullpath_of_open_card(card_name), stat, stored):
+                status[card_name] = MODIFIED
+            else:
+                status[card_name] = UNCHANGED
+    for card_name in open_cards:
+        if card_name not in status:
+            status[card_name] = NEW
+    return status
 
-            if card_mtime_ns > note_mtime_ns:
-                modified.add(card_name)
 
-    return modified
+def modified_cards(note_files: NoteFiles, database_handle: sqlite3.Connection):
+    """ @Robustness: Exception safety """
+    return set(card_name for card_name, status in card_status(note_files, database_handle).items() if status == MODIFIED)
 
 
 def new_cards(note_files: NoteFiles, database_handle: sqlite3.Connection):
@@ -112,4 +236,3 @@ def new_cards(note_files: NoteFiles, database_handle: sqlite3.Connection):
 
     notes = set(note[0] for note in list_of_notes)
     return open_cards.difference(notes)
-
@@ -0,0 +1,231 @@
+"""
+Profiling of a zk command, turned on with `zk --database DB <command> --profile[=FILE]` or the
+environment variable ZK_PROFILE=1 or ZK_PROFILE=FILE.
+
+The connection of the command is a TracedConnection, which counts the statements, the rows
+fetched and the time spent in each statement. Its trace callback counts all statements that
+SQLite runs, including the transaction control that the sqlite3 module adds. The major phases
+of the command are timed with `phase`, which costs nothing when profiling is off. Phases nest,
+e.g. the commit is a part of the save. A summary table is printed when the command exits, and
+if a file is given the whole command is also profiled with cProfile and the statistics are
+dumped into the file.
+"""
+
+import sys
+import time
+import sqlite3
+from typing import *
+
+SUMMARY_STATEMENTS = 20
+SUMMARY_STATEMENT_WIDTH = 64
+
+# Statements that the sqlite3 module runs without a cursor
+TRANSACTION_CONTROL = ('BEGIN', 'COMMIT', 'ROLLBACK')
+
+
+class StatementStats:
+    __slots__ = ('calls', 'executed', 'rows', 'seconds')
+
+    def __init__(self):
+        self.calls = 0     # execute, executemany and executescript calls
+        self.executed = 0  # Executions, e.g. each row of an executemany
+        self.rows = 0      # Rows fetched
+        self.seconds = 0.0
+
+
+class Profile:
+    def __init__(self, output_path: Optional[str] = None):
+        """
+        :param output_path: File for the cProfile statistics, or None for only the summary
+        """
+        self.output_path = output_path
+        self.statements: Dict[str, StatementStats] = {}
+        self.phases: Dict[str, List[float]] = {}  # name: [calls, seconds]
+        self.traced = 0  # All statements run by SQLite
+        self._start = time.perf_counter()
+        self._elapsed = None
+        self._cprofile = None
+        if output_path:
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def statement(self, sql: str) -> StatementStats:
+        stats = self.statements.get(sql)
+        if stats is None:
+            stats = self.statements[sql] = StatementStats()
+        return stats
+
+    def add_phase(self, name: str, seconds: float):
+        calls_and_seconds = self.phases.setdefault(name, [0, 0.0])
+        calls_and_seconds[0] += 1
+        calls_and_seconds[1] += seconds
+
+    def stop(self):
+        self._elapsed = time.perf_counter() - self._start
+        if self._cprofile:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self.output_path)
+
+    def print_summary(self, file: TextIO = sys.stderr):
+        elapsed = self._elapsed if self._elapsed is not None else time.perf_counter() - self._start
+        print(f'Total {elapsed * 1000:.1f} ms', file=file)
+
+        print(f'\n{"phase":<{SUMMARY_STATEMENT_WIDTH}} {"calls":>8} {"ms":>10}', file=file)
+        for name, (calls, seconds) in sorted(self.phases.items(), key=lambda item: -item[1][1]):
+            print(f'{name:<{SUMMARY_STATEMENT_WIDTH}} {calls:>8} {seconds * 1000:>10.1f}', file=file)
+
+        statements = sorted(self.statements.items(), key=lambda item: -item[1].seconds)
+        print(f'\n{"statement":<{SUMMARY_STATEMENT_WIDTH}} {"calls":>8} {"executed":>8} {"rows":>8} {"ms":>10}', file=file)
+        for sql, stats in statements[:SUMMARY_STATEMENTS]:
+            print(f'{_shorten(sql):<{SUMMARY_STATEMENT_WIDTH}} {stats.calls:>8} {stats.executed:>8} '
+                  f'{stats.rows:>8} {stats.seconds * 1000:>10.1f}', file=file)
+        if len(statements) > SUMMARY_STATEMENTS:
+            print(f'... and {len(statements) - SUMMARY_STATEMENTS} other statements', file=file)
+        print(f'{"all statements":<{SUMMARY_STATEMENT_WIDTH}} {sum(stats.calls for _, stats in statements):>8} '
+              f'{sum(stats.executed for _, stats in statements):>8} {sum(stats.rows for _, stats in statements):>8} '
+              f'{sum(stats.seconds for _, stats in statements) * 1000:>10.1f}', file=file)
+        print(f'SQLite ran {self.traced} statements', file=file)
+        if self.output_path:
+            print(f'\ncProfile statistics were written into {self.output_path}', file=file)
+
+
+_profile: Optional[Profile] = None
+
+
+def start(output_path: Optional[str] = None) -> Profile:
+    global _profile
+    _profile = Profile(output_path)
+    return _profile
+
+
+def stop() -> Optional[Profile]:
+    global _profile
+    profile, _profile = _profile, None
+    if profile:
+        profile.stop()
+    return profile
+
+
+def active() -> Optional[Profile]:
+    return _profile
+
+
+class phase:
+    """ Time a phase of the command if profiling is on, e.g. `with profiling.phase('save'): ...` """
+    __slots__ = ('_name', '_start')
+
+    def __init__(self, name: str):
+        self._name = name
+        self._start = 0.0
+
+    def __enter__(self):
+        if _profile:
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        if _profile:
+            _profile.add_phase(self._name, time.perf_counter() - self._start)
+        return False
+
+
+class TracedCursor(sqlite3.Cursor):
+    """ Times the statements and counts the rows fetched. The time of fetching the rows is added
+    to the last executed statement. """
+    _sql = None
+
+    def _timed(self, stats: StatementStats, sql: str, method: Callable, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            stats.calls += 1
+            stats.seconds += time.perf_counter() - start
+            self._sql = sql
+
+    def execute(self, sql: str, parameters=()):
+        stats = _profile.statement(sql) if _profile else StatementStats()
+        stats.executed += 1
+        return self._timed(stats, sql, super().execute, sql, parameters)
+
+    def executemany(self, sql: str, parameters):
+        stats = _profile.statement(sql) if _profile else StatementStats()
+        return self._timed(stats, sql, super().executemany, sql, _counted(parameters, stats))
+
+    def executescript(self, sql_script: str):
+        stats = _profile.statement(sql_script) if _profile else StatementStats()
+        stats.executed += 1
+        return self._timed(stats, sql_script, super().executescript, sql_script)
+
+    def _fetched(self, method: Callable, *args):
+        start = time.perf_counter()
+        result = method(*args)
+        if _profile and self._sql is not None:
+            stats = _profile.statement(self._sql)
+            stats.seconds += time.perf_counter() - start
+            stats.rows += len(result) if isinstance(result, list) else result is not None
+        return result
+
+    def fetchone(self):
+        return self._fetched(super().fetchone)
+
+    def fetchmany(self, size: int = 1):
+        return self._fetched(super().fetchmany, size)
+
+    def fetchall(self):
+        return self._fetched(super().fetchall)
+
+    def __next__(self):
+        return self._fetched(super().__next__)
+
+
+class TracedConnection(sqlite3.Connection):
+    """ Connection whose cursors are TracedCursors. The statements that SQLite runs are counted
+    with the trace callback. Use as the factory of sqlite3.connect. """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.set_trace_callback(self._trace)
+
+    def _trace(self, sql: str):
+        if not _profile:
+            return
+        _profile.traced += 1
+        if sql.startswith(TRANSACTION_CONTROL):
+            stats = _profile.statement(sql.strip())
+            stats.calls += 1
+            stats.executed += 1
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql: str, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, parameters):
+        return self.cursor().executemany(sql, parameters)
+
+    def executescript(self, sql_script: str):
+        return self.cursor().executescript(sql_script)
+
+    def commit(self):
+        with phase('commit'):
+            super().commit()
+
+    def __exit__(self, exception_type, exception, traceback):
+        # The context manager commits without calling commit()
+        with phase('commit' if exception_type is None else 'rollback'):
+            return super().__exit__(exception_type, exception, traceback)
+
+
+def _counted(parameters: Iterable, stats: StatementStats) -> Iterator:
+    for row in parameters:
+        stats.executed += 1
+        yield row
+
+
+def _shorten(sql: str) -> str:
+    sql = ' '.join(sql.split())
+    if len(sql) > SUMMARY_STATEMENT_WIDTH:
+        sql = sql[:SUMMARY_STATEMENT_WIDTH - 3] + '...'
+    return sql
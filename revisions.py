@@ -0,0 +1,111 @@
+"""
+Revision history of the cards. Every saved change of a card is a revision. A revision is
+stored as a delta against the previous revision, and every SNAPSHOT_INTERVAL revisions as
+a snapshot, so that reading a revision applies at most SNAPSHOT_INTERVAL - 1 deltas.
+
+A snapshot isn't a copy of the content: it refers to the blob of the content by the content
+hash, and the blob is kept as long as a revision refers to it. The revisions of large cards,
+which are streamed into the blobs table, are all snapshots. Full copies are only in databases
+from before, see sql/upgrade_13_to_14.py.
+"""
+
+import sqlite3
+from typing import *
+
+import delta
+import database_functions
+
+FULL = 'full'
+DELTA = 'delta'
+BLOB = 'blob'
+
+SNAPSHOT_INTERVAL = 16
+
+
+class Revision(NamedTuple):
+    revision: int
+    kind: str
+    content_hash: str
+    size: int
+    stored_size: int
+    modified_utc: int
+
+
+class Change(NamedTuple):
+    """ A new version of a card. The previous content is None for a new card and for a large
+    card, and the content is None for a large card. """
+    name: str
+    previous_content: Optional[bytes]
+    content: Optional[bytes]
+    content_hash: str
+    size: int
+    modified_utc: int
+
+
+def record_revisions(cursor: sqlite3.Cursor, changes: List[Change]):
+    """ Add a revision for each changed card. Doesn't commit. """
+    latest = _latest_revisions(cursor, [change.name for change in changes])
+    revision_rows = []
+    for change in changes:
+        last_revision, last_full_revision = latest.get(change.name, (0, 0))
+        revision = last_revision + 1
+        kind, data = BLOB, b''
+        if (change.content is not None and change.previous_content is not None and last_revision > 0 and
+                revision - last_full_revision < SNAPSHOT_INTERVAL):
+            delta_data = delta.diff(change.previous_content, change.content)
+            if len(delta_data) < _stored_size(cursor, change.content_hash):
+                kind, data = DELTA, delta_data
+        revision_rows.append((change.name, revision, kind, 'raw', change.content_hash, change.size, change.modified_utc, data))
+    cursor.executemany('insert into revisions(name, revision, kind, codec, content_hash, size, modified_utc, data) '
+                       'values (?, ?, ?, ?, ?, ?, ?, ?)', revision_rows)
+
+
+def _stored_size(cursor: sqlite3.Cursor, digest: str) -> int:
+    """ Size of the stored blob, which is kept for a snapshot """
+    cursor.execute('select length(data) from blobs where hash = ?', (digest,))
+    return cursor.fetchone()[0]
+
+
+def _latest_revisions(cursor: sqlite3.Cursor, card_names: List[str]) -> Dict[str, Tuple[int, int]]:
+    """ Return the last revision and the last full or blob revision of each card """
+    latest = {}
+    for card_name in card_names:
+        cursor.execute("select max(revision), max(case when kind <> 'delta' then revision end) from revisions where name = ?",
+                       (card_name,))
+        last_revision, last_full_revision = cursor.fetchone()
+        if last_revision is not None:
+            latest[card_name] = (last_revision, last_full_revision or 0)
+    return latest
+
+
+def card_log(database_handle: sqlite3.Connection, card_name: str) -> List[Revision]:
+    """ Return the revisions of a card, the newest first """
+    cursor = database_handle.cursor()
+    cursor.execute('select revision, kind, content_hash, size, length(data), modified_utc from revisions '
+                   'where name = ? order by revision desc', (card_name,))
+    log = [Revision(*row) for row in cursor]
+    cursor.close()
+    return log
+
+
+def read_revision(database_handle: sqlite3.Connection, card_name: str, revision: int) -> Optional[bytes]:
+    """ Return the content of a card at the given revision or None if there is no such revision """
+    cursor = database_handle.cursor()
+    cursor.execute("select revision, kind, revisions.codec, revisions.data, blobs.codec, blobs.data from revisions "
+                   "left join blobs on revisions.kind = 'blob' and blobs.hash = revisions.content_hash "
+                   "where name = ? and revision <= ? "
+                   "and revision >= (select max(revision) from revisions where name = ? and kind <> 'delta' and revision <= ?) "
+                   "order by revision", (card_name, revision, card_name, revision))
+    rows = cursor.fetchall()
+    cursor.close()
+    if not rows or rows[-1][0] != revision:
+        return None
+
+    content = b''
+    for _, kind, codec, data, blob_codec, blob_data in rows:
+        if kind == BLOB:
+            content = database_functions.decompress(blob_codec, blob_data)
+            continue
+        data = database_functions.decompress(codec, data)
+        content = data if kind == FULL else delta.patch(content, data)
+    return content
@@ -0,0 +1,140 @@
+"""
+API for the scripts that `zk script <name>` runs. A script is a module in the scripts folder
+with a function `run(database_handle)`. The functions here read the cards in batches with a
+constant amount of memory, and run a function on every card in a pool of processes:
+
+    import scripting
+
+    def count_words(note: scripting.ScriptNote) -> int:
+        return len(note.text().split())
+
+    def run(database_handle):
+        total = sum(words for _, words in scripting.imap_notes(database_handle, count_words))
+
+A function that fixes the cards returns their new content and map_notes saves it:
+
+    def rename_tag(note: scripting.ScriptNote) -> Optional[str]:
+        text = note.text()
+        return text.replace('#todo', '#task') if '#todo' in text else None
+
+    def run(database_handle):
+        scripting.map_notes(database_handle, rename_tag)
+
+The function has to be defined at the top level of the script so that the worker processes
+can find it. Save the open cards before running a script.
+"""
+
+import os
+import sqlite3
+from typing import *
+
+import database_functions
+
+DEFAULT_BATCH_SIZE = 200
+
+_SELECT_NOTES = ('select name, created_ns, modified_ns, notes.size, header_date, title, daily, content_hash{content} '
+                 'from notes{join} where name > ? order by name limit ?')
+
+
+class ScriptNote(NamedTuple):
+    """ A card with its metadata. The content is stored compressed and it's decompressed only when
+    it's asked for, so a batch of cards is cheap to send to a worker process. """
+    name: str
+    created_ns: Optional[int]
+    modified_ns: Optional[int]
+    size: int
+    header_date: Optional[str]
+    title: Optional[str]
+    daily: bool
+    content_hash: str
+    codec: Optional[str] = None
+    data: Optional[bytes] = None
+
+    def content(self) -> bytes:
+        if self.codec is None:
+            raise ValueError(f'The content of {self.name} was not read')
+        return database_functions.decompress(self.codec, self.data)
+
+    def text(self) -> str:
+        return self.content().decode('utf-8', errors='replace')
+
+
+def iter_notes(database_handle: sqlite3.Connection, batch_size: int = DEFAULT_BATCH_SIZE,
+               with_content: bool = True) -> Iterator[List[ScriptNote]]:
+    """ Yield all cards in batches, in the order of the names. Each batch is a separate query that
+    continues from the last name of the previous batch, so the database isn't kept locked
+    between the batches.
+    :param with_content: False to read only the metadata
+    """
+    if batch_size < 1:
+        raise ValueError(f'Invalid batch size: {batch_size}')
+    query = _SELECT_NOTES.format(content=', codec, data' if with_content else '',
+                                 join=' join blobs on blobs.hash = notes.content_hash' if with_content else '')
+    last_name = ''
+    while True:
+        cursor = database_handle.cursor()
+        cursor.execute(query, (last_name, batch_size))
+        batch = [ScriptNote(*row[:6], bool(row[6]), *row[7:]) for row in cursor.fetchall()]
+        cursor.close()
+        if not batch:
+            break
+        yield batch
+        if len(batch) < batch_size:
+            break
+        last_name = batch[-1].name
+
+
+def imap_notes(database_handle: sqlite3.Connection, fn: Callable[[ScriptNote], Any], workers: Optional[int] = None,
+               batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[Tuple[str, Any]]:
+    """ Run the function on every card and yield the card names with the results that aren't None,
+    in the order of the names. The batches are run in a pool of processes, and only a few batches
+    per worker are read ahead.
+    :param workers: Number of processes, the number of CPUs by default. With 1 the function is run
+        in this process.
+    """
+    workers = workers or os.cpu_count() or 1
+    batches = iter_notes(database_handle, batch_size)
+    if workers == 1:
+        for batch in batches:
+            yield from _apply(fn, batch)
+        return
+
+    import itertools
+    import collections
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque(executor.submit(_apply, fn, batch) for batch in itertools.islice(batches, 2 * workers))
+        while pending:
+            results = pending.popleft().result()
+            for batch in itertools.islice(batches, 1):
+                pending.append(executor.submit(_apply, fn, batch))
+            yield from results
+
+
+def map_notes(database_handle: sqlite3.Connection, fn: Callable[[ScriptNote], Union[str, bytes, None]],
+              workers: Optional[int] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+              progress: Optional[Callable[[int], None]] = None) -> int:
+    """ Run the function on every card as imap_notes does and save what it returns as the new content
+    of the card. None leaves the card as it is. The new contents are saved in a transaction per batch.
+    :param progress: Called with the number of changed cards so far after each batch
+    :return: Number of changed cards
+    """
+    from note_database import NoteDatabase, _batches
+    store = NoteDatabase(database_handle)
+    results = imap_notes(database_handle, fn, workers, batch_size)
+    saved = 0
+    for batch in _batches(results, batch_size):
+        contents = [(card_name, content.encode('utf-8') if isinstance(content, str) else content) for card_name, content in batch]
+        saved += store.save_contents(contents, batch_size)
+        if progress:
+            progress(saved)
+    return saved
+
+
+def _apply(fn: Callable[[ScriptNote], Any], batch: List[ScriptNote]) -> List[Tuple[str, Any]]:
+    results = []
+    for note in batch:
+        result = fn(note)
+        if result is not None:
+            results.append((note.name, result))
+    return results
@@ -9,14 +9,16 @@ schema_version table. Afterwards, merge also sql/version.sql into sql/schema.sql
 """
 
 import os
-import sys
 import sqlite3
 
+import database_functions
+
+PROJECT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
 
 def run(database_handle: sqlite3.Connection):
     """ Create the schema_version table. This is prerequisite to run ugprade and rollback functionality """
-    project_folder = os.path.dirname(os.path.abspath(sys.argv[0]))
-    sql_path = os.path.join(project_folder, 'sql', 'version.sql')
+    sql_path = os.path.join(PROJECT_FOLDER, 'sql', 'version.sql')
     _execute_script(database_handle, sql_path)
 
 
@@ -28,8 +30,15 @@ def _get_version(database_handle: sqlite3.Connection):
     return version
 
 
+def latest_version() -> int:
+    """ The newest version that there is an upgrade for """
+    import migrations
+    return migrations.latest_version()
+
+
 def _execute_script(database_handle: sqlite3.Connection, script_path: str):
     """ @Safety: It might fail """
+    database_functions.register(database_handle)
     cursor = database_handle.cursor()
     with open(script_path, 'r') as fd:
         sql = fd.read()
@@ -38,47 +47,23 @@ def _execute_script(database_handle: sqlite3.Connection, script_path: str):
     cursor.close()
 
 
-def _set_version(database_handle: sqlite3.Connection, version: int):
-    version_row = (version,)
-    cursor = database_handle.cursor()
-    cursor.execute('delete from schema_version')
-    cursor.execute('insert into schema_version(version) values (?)', version_row)
-    database_handle.commit()
-    cursor.close()
-
-
 def upgrade_version_up(database_handle: sqlite3.Connection, next_version: int):
-    """ Install the next schema version `sql/upgrade_{current_version}_to_{next_version}.sql`,
-    but only if the next version is current version + 1.
+    """ Install the next schema version, but only if the next version is current version + 1.
+    See migrations.migrate for moving several versions at a time.
     """
-    expected_current_version = next_version - 1
-    project_folder = os.path.dirname(os.path.abspath(sys.argv[0]))
-    sql_name = f'upgrade_{expected_current_version}_to_{next_version}.sql'
-    sql_path = os.path.join(project_folder, 'sql', sql_name)
-    if not os.path.isfile(sql_path):
-        raise RuntimeError(f'Missing sql path: {sql_path}')
-    current_version = _get_version(database_handle)
-    if current_version != expected_current_version:
-        raise RuntimeError(f'Invalid version bump, going from {current_version} to {next_version}')
-
-    _execute_script(database_handle, sql_path)
-    _set_version(database_handle, next_version)
+    _migrate_one_step(database_handle, next_version, next_version - 1)
 
 
 def rollback_version_down(database_handle: sqlite3.Connection, next_version: int):
-    """ Install the previous schema version `sql/rollback_{current_version}_to_{next_version}.sql`,
-    but only if the next version is current version - 1.
+    """ Install the previous schema version, but only if the next version is current version - 1.
+    See migrations.migrate for moving several versions at a time.
     """
-    expected_current_version = next_version + 1
-    project_folder = os.path.dirname(os.path.abspath(sys.argv[0]))
-    sql_name = f'rollback_{expected_current_version}_to_{next_version}.sql'
-    sql_path = os.path.join(project_folder, 'sql', sql_name)
-    if not os.path.isfile(sql_path):
-        raise RuntimeError(f'Missing sql path: {sql_path}')
+    _migrate_one_step(database_handle, next_version, next_version + 1)
+
+
+def _migrate_one_step(database_handle: sqlite3.Connection, next_version: int, expected_current_version: int):
+    import migrations
     current_version = _get_version(database_handle)
     if current_version != expected_current_version:
         raise RuntimeError(f'Invalid version bump, going from {current_version} to {next_version}')
-
-    _execute_script(database_handle, sql_path)
-    _set_version(database_handle, next_version)
-
+    migrations.migrate(database_handle, next_version)
@@ -0,0 +1,2 @@
+drop index links_dst;
+drop table links;
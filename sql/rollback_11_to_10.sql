@@ -0,0 +1,7 @@
+drop index notes_header_date;
+drop index card_tags_name;
+drop table card_tags;
+
+alter table notes drop column daily;
+alter table notes drop column title;
+alter table notes drop column header_date;
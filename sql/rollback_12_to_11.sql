@@ -0,0 +1,10 @@
+drop index notes_modified;
+
+alter table notes add column created_utc text;
+alter table notes add column modified_utc text;
+
+update notes set created_utc = cast(created_ns / 1000000000 as text),
+                 modified_utc = cast(modified_ns / 1000000000 as text);
+
+alter table notes drop column modified_ns;
+alter table notes drop column created_ns;
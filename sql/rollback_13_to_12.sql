@@ -0,0 +1 @@
+alter table notes drop column saved_ns;
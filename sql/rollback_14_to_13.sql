@@ -0,0 +1 @@
+-- Nothing to undo: the revisions that refer to blobs are read and kept as in version 13
@@ -0,0 +1,3 @@
+alter table notes drop column mtime_ns;
+alter table notes drop column size;
+alter table notes drop column content_hash;
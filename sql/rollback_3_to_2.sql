@@ -0,0 +1 @@
+drop table major_allocator;
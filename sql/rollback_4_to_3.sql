@@ -0,0 +1,8 @@
+drop index notes_sort_key;
+drop index notes_parent;
+drop index notes_major;
+
+alter table notes drop column sort_key;
+alter table notes drop column depth;
+alter table notes drop column parent;
+alter table notes drop column major;
@@ -0,0 +1 @@
+drop table notes_fts;
@@ -0,0 +1,7 @@
+drop index notes_content_hash;
+
+alter table notes add column content blob;
+
+update notes set content = (select zk_decompress(codec, data) from blobs where blobs.hash = notes.content_hash);
+
+drop table blobs;
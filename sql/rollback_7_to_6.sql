@@ -0,0 +1,4 @@
+-- The blobs that only revisions refer to
+delete from blobs where not exists (select 1 from notes where content_hash = blobs.hash);
+
+drop table revisions;
@@ -0,0 +1 @@
+drop index revisions_blob;
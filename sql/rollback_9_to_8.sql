@@ -0,0 +1,8 @@
+drop table sync_state;
+drop table sync_identity;
+drop table sync_counter;
+
+drop index notes_seq;
+
+alter table notes drop column origin;
+alter table notes drop column seq;
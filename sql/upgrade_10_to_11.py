@@ -0,0 +1,38 @@
+"""
+Metadata from the first line of the cards, see database_functions.content_header. The headers
+are parsed in batches, see migrations.
+"""
+
+import json
+
+BEFORE = '''
+alter table notes add column header_date text;                 -- YYYY-MM-DD
+alter table notes add column title text;
+alter table notes add column daily integer not null default 0; -- 1 if the first line is "YYYY-MM-DD Daily"
+
+create table card_tags (
+    tag text not null,
+    name text not null,
+    primary key (tag, name)
+) without rowid;
+
+create index card_tags_name on card_tags(name);
+'''
+
+TABLE = 'notes'
+
+
+def rewrite(cursor, after_rowid: int, last_rowid: int):
+    cursor.execute('select notes.name, zk_header(zk_decompress(codec, data)) '
+                   'from notes join blobs on blobs.hash = notes.content_hash '
+                   'where notes.rowid > ? and notes.rowid <= ?', (after_rowid, last_rowid))
+    headers = [(card_name, json.loads(header)) for card_name, header in cursor.fetchall()]
+    cursor.executemany('update notes set header_date = ?, title = ?, daily = ? where name = ?',
+                       [(header['date'], header['title'], int(header['daily']), card_name) for card_name, header in headers])
+    cursor.executemany('insert or ignore into card_tags(tag, name) values (?, ?)',
+                       [(tag, card_name) for card_name, header in headers for tag in header['tags']])
+
+
+AFTER = '''
+create index notes_header_date on notes(header_date);
+'''
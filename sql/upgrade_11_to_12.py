@@ -0,0 +1,26 @@
+"""
+Timestamps as integer nanoseconds since epoch instead of text seconds. The rows are converted
+in batches, see migrations.
+"""
+
+BEFORE = '''
+alter table notes add column created_ns integer;
+alter table notes add column modified_ns integer;
+'''
+
+TABLE = 'notes'
+
+
+def rewrite(cursor, after_rowid: int, last_rowid: int):
+    cursor.execute('update notes set created_ns = cast(created_utc as integer) * 1000000000, '
+                   'modified_ns = coalesce(mtime_ns, cast(modified_utc as integer) * 1000000000) '
+                   'where rowid > ? and rowid <= ?', (after_rowid, last_rowid))
+
+
+AFTER = '''
+alter table notes drop column created_utc;
+alter table notes drop column modified_utc;
+
+-- Recently modified cards, see NoteDatabase.iter_recent_cards
+create index notes_modified on notes(modified_ns, name);
+'''
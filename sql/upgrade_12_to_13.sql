@@ -0,0 +1,3 @@
+-- When the stat data of a card was saved, see note_database.is_unchanged_stat. The stat data of
+-- the existing rows is ambiguous until the cards are saved again.
+alter table notes add column saved_ns integer;
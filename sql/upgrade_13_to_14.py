@@ -0,0 +1,12 @@
+"""
+Full revisions whose content is stored as a blob refer to the blob instead of keeping a copy,
+see revisions.py. The revisions are converted in batches, see migrations.
+"""
+
+TABLE = 'revisions'
+
+
+def rewrite(cursor, after_rowid: int, last_rowid: int):
+    cursor.execute("update revisions set kind = 'blob', codec = 'raw', data = x'' "
+                   "where rowid > ? and rowid <= ? and kind = 'full' "
+                   "and exists (select 1 from blobs where hash = revisions.content_hash)", (after_rowid, last_rowid))
@@ -0,0 +1,10 @@
+-- Store the content hash and the stat data of the card file, so that unchanged cards
+-- can be skipped without reading them.
+alter table notes add column content_hash text;  -- zk_sha256 of the content
+alter table notes add column size integer;       -- Size of the content in bytes
+alter table notes add column mtime_ns integer;   -- Modification time of the card file in nanoseconds
+
+update notes set
+    content_hash = zk_sha256(content),
+    size = length(content),
+    mtime_ns = cast(modified_utc as integer) * 1000000000;
@@ -0,0 +1,7 @@
+-- Contains a single row: the last major card number that has been handed out
+create table major_allocator (
+    last_major integer not null
+);
+
+insert into major_allocator(last_major)
+    select coalesce(max(cast(name as integer)), 0) from notes where name <> '' and name not glob '*[^0-9]*';
@@ -0,0 +1,15 @@
+-- Parsed hierarchy of the card name, see card_name.py. Null for names that are not card names.
+alter table notes add column major integer;  -- e.g. 19 for 19a2
+alter table notes add column parent text;    -- e.g. 19a for 19a2, null for major cards
+alter table notes add column depth integer;  -- 0 for major cards
+alter table notes add column sort_key text;  -- Natural sort order, descendants of a card are a range
+
+update notes set
+    major = zk_card_major(name),
+    parent = zk_card_parent(name),
+    depth = zk_card_depth(name),
+    sort_key = zk_card_sort_key(name);
+
+create index notes_major on notes(major, sort_key);
+create index notes_parent on notes(parent, sort_key);
+create index notes_sort_key on notes(sort_key);
@@ -0,0 +1,4 @@
+-- Full-text index of the card contents. The rowid is the rowid of the card in notes.
+create virtual table notes_fts using fts5(name unindexed, body);
+
+insert into notes_fts(rowid, name, body) select rowid, name, zk_text(content) from notes;
@@ -0,0 +1,31 @@
+"""
+Card contents by content hash in a table of compressed blobs. The contents are copied in
+batches, see migrations, and each batch clears the copied column values so that dropping the
+column at the end doesn't rewrite the contents again.
+"""
+
+BEFORE = '''
+-- Card contents by content hash. Cards with the same content share a row.
+create table blobs (
+    hash text primary key,  -- zk_sha256 of the uncompressed content, notes.content_hash
+    codec text not null,    -- raw, zlib or lzma
+    size integer not null,  -- Size of the uncompressed content in bytes
+    data blob not null
+);
+'''
+
+TABLE = 'notes'
+
+
+def rewrite(cursor, after_rowid: int, last_rowid: int):
+    cursor.execute('insert or ignore into blobs(hash, codec, size, data) '
+                   'select content_hash, zk_codec(content), length(content), zk_compress(content) from notes '
+                   'where rowid > ? and rowid <= ? and content is not null', (after_rowid, last_rowid))
+    cursor.execute('update notes set content = null where rowid > ? and rowid <= ?', (after_rowid, last_rowid))
+
+
+AFTER = '''
+alter table notes drop column content;
+
+create index notes_content_hash on notes(content_hash);
+'''
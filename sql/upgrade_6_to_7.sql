@@ -0,0 +1,17 @@
+-- Every saved version of a card, see revisions.py
+create table revisions (
+    name text not null,
+    revision integer not null,     -- 1 for the first saved version
+    kind text not null,            -- full: data is the content, delta: data is a delta against the previous revision
+    codec text not null,           -- Compression of the data, as in blobs
+    content_hash text not null,
+    size integer not null,         -- Size of the content in bytes
+    modified_utc integer,          -- Seconds since epoch
+    data blob not null,
+    primary key (name, revision)
+);
+
+-- The current contents become the first revisions, which refer to the blobs of the contents
+insert into revisions(name, revision, kind, codec, content_hash, size, modified_utc, data)
+    select name, 1, 'blob', 'raw', content_hash, notes.size, cast(modified_utc as integer), x''
+    from notes join blobs on blobs.hash = notes.content_hash;
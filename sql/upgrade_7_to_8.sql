@@ -0,0 +1,2 @@
+-- Revisions of large cards refer to the blobs table, which keeps the blobs they refer to
+create index revisions_blob on revisions(content_hash) where kind = 'blob';
@@ -0,0 +1,29 @@
+-- Change log for syncing databases, see sync.py. Every write of a card takes the next sequence
+-- number of this database, and the origin is the host where the card was saved.
+alter table notes add column seq integer;
+alter table notes add column origin text;
+
+update notes set seq = rowid;
+
+create index notes_seq on notes(seq);
+
+-- Contains a single row: the last sequence number that has been handed out
+create table sync_counter (
+    last_seq integer not null
+);
+
+insert into sync_counter(last_seq) select coalesce(max(seq), 0) from notes;
+
+-- Contains a single row: the identifier of this database, which other databases use in sync_state
+create table sync_identity (
+    id text not null
+);
+
+insert into sync_identity(id) values (lower(hex(randomblob(16))));
+
+-- The databases that this database has been synced with
+create table sync_state (
+    peer text primary key,          -- sync_identity.id of the other database
+    pulled_seq integer not null,    -- Changes of the other database up to this sequence number have been received
+    pushed_seq integer not null     -- Changes of this database up to this sequence number have been sent
+);
@@ -0,0 +1,14 @@
+-- References between cards, e.g. [19a2] in the content of 20. The referred card doesn't have
+-- to exist. Updated whenever a card is saved, see database_functions.content_links.
+create table links (
+    src text not null,
+    dst text not null,
+    primary key (src, dst)
+) without rowid;
+
+create index links_dst on links(dst, src);
+
+insert or ignore into links(src, dst)
+    select notes.name, json_each.value
+    from notes join blobs on blobs.hash = notes.content_hash, json_each(zk_links(zk_decompress(codec, data)))
+    where json_each.value <> notes.name;
@@ -0,0 +1,142 @@
+"""
+Sync the cards of two databases, e.g. copies of the notes on different hosts.
+
+Every write of a card takes the next sequence number of its database (notes.seq), so the
+changes since the last sync are the cards whose sequence number is larger than the one
+recorded in sync_state. Syncing reads only those cards, and its cost grows with the number of
+changes, not with the number of cards.
+
+A card is in conflict when it has been changed in both databases since the last sync. The
+conflicts are resolved with one of the policies:
+
+- MTIME: the version with the newer modification time is kept in both databases. The other
+  version remains in the revision history of the database that had it.
+- KEEP_BOTH: as MTIME, and the other version is also saved as a new branch of the card.
+
+Cards are never removed, so there are no deletions to sync.
+
+The local notes folder takes part in the sync too. An open card that the other database has
+changed and whose file has been edited since it was saved is saved first, so the edit is a
+local change in conflict with the other one. After the sync, the open cards whose saved content
+has changed are returned to be written into the folder, see zk.unpack_cards.
+"""
+
+import sqlite3
+from typing import *
+
+import card_name as CN
+from note_database import NoteDatabase, is_unchanged_stat
+
+MTIME = 'mtime'
+KEEP_BOTH = 'keep-both'
+POLICIES = (MTIME, KEEP_BOTH)
+
+
+class Conflict(NamedTuple):
+    card_name: str
+    kept_origin: Optional[str]       # Origin of the version that was kept under the card name
+    other_name: Optional[str]        # Name of the other version with KEEP_BOTH
+
+
+class SyncResult(NamedTuple):
+    pulled: int                      # Cards written into the local database
+    pushed: int                      # Cards written into the other database
+    conflicts: List[Conflict]
+    outdated_files: List[str]        # Open cards whose files have older content than the local database
+
+
+def sync(local_handle: sqlite3.Connection, remote_handle: sqlite3.Connection, policy: str = MTIME,
+         batch_size: int = NoteDatabase.DEFAULT_BATCH_SIZE, open_notes=None) -> SyncResult:
+    """ Exchange the cards changed since the last sync between the databases. Both databases are
+    written in one transaction each, and the local one is committed last.
+    :param open_notes: note_folder.NoteFiles of the local database
+    """
+    if policy not in POLICIES:
+        raise ValueError(f'Unknown conflict policy: {policy}')
+    local = NoteDatabase(local_handle)
+    remote = NoteDatabase(remote_handle)
+    local_id = local.database_id()
+    remote_id = remote.database_id()
+    if local_id == remote_id:
+        raise RuntimeError('Cannot sync a database with itself or its copy')
+
+    # The states are equal unless a database has been restored from a backup. Then
+    # the older state is used, which only sends some unchanged cards again.
+    local_pulled, local_pushed = local.sync_state(remote_id)
+    remote_pulled, remote_pushed = remote.sync_state(local_id)
+    pulled_seq = min(local_pulled, remote_pushed)
+    pushed_seq = min(local_pushed, remote_pulled)
+    file_hashes = _save_edited_files(local, remote, pulled_seq, open_notes) if open_notes else {}
+
+    with local_handle, remote_handle:
+        conflicts = []
+        pulled = _transfer(remote, local, pulled_seq, pushed_seq, policy, batch_size, conflicts)
+        # The local changes include the cards that were just pulled. They are identical in the
+        # other database and are skipped.
+        pushed = _transfer(local, remote, pushed_seq, remote.last_sequence(), policy, batch_size, conflicts)
+        local_last, remote_last = local.last_sequence(), remote.last_sequence()
+        local.set_sync_state(remote_id, remote_last, local_last)
+        remote.set_sync_state(local_id, local_last, remote_last)
+    synced = local.stored_stats(file_hashes)
+    outdated_files = sorted(card_name for card_name, digest in file_hashes.items() if synced[card_name].content_hash != digest)
+    return SyncResult(pulled, pushed, conflicts, outdated_files)
+
+
+def _save_edited_files(local: NoteDatabase, remote: NoteDatabase, pulled_seq: int, open_notes) -> Dict[str, str]:
+    """ Save the open cards that have been changed in the other database and edited in the folder
+    :return: Content hashes of the files of the open cards changed in the other database
+    """
+    open_stats = open_notes.stat_of_open_cards()
+    incoming = [card_name for card_name, change in remote.stored_changes(open_stats).items()
+                if (change.seq or 0) > pulled_seq]
+    stored_stats = local.stored_stats(incoming)
+    edited = [card_name for card_name in incoming
+              if card_name not in stored_stats or not is_unchanged_stat(open_stats[card_name], stored_stats[card_name])]
+    # Files whose content is saved already are only touched, and stale files are skipped
+    local.save_cards(((card_name, open_notes.fullpath_of_open_card(card_name)) for card_name in edited), stats=open_stats)
+    return {card_name: stored.content_hash for card_name, stored in local.stored_stats(incoming).items()}
+
+
+def _transfer(source: NoteDatabase, target: NoteDatabase, since_seq: int, target_synced_seq: int,
+              policy: str, batch_size: int, conflicts: List[Conflict]) -> int:
+    """ Write the cards changed in the source after `since_seq` into the target. A card that has been
+    changed in the target after `target_synced_seq` is a conflict.
+    :return: Number of cards written
+    """
+    written = 0
+    for changes in source.iter_changes(since_seq, batch_size):
+        stored = target.stored_changes(change['name'] for change in changes)
+        accepted = []
+        for change in changes:
+            card_name = change['name']
+            target_card = stored.get(card_name)
+            if target_card and target_card.content_hash == change['content_hash']:
+                continue
+            if not target_card or (target_card.seq or 0) <= target_synced_seq:
+                accepted.append(change)
+                continue
+
+            source_is_newer = (change['mtime_ns'] or 0) > (target_card.mtime_ns or 0)
+            other_name = None
+            if policy == KEEP_BOTH:
+                other_version = change if not source_is_newer else target.read_change(card_name)
+                other_name = _free_branch_name(card_name, source, target)
+                if other_name:
+                    accepted.append(dict(other_version, name=other_name))
+            if source_is_newer:
+                accepted.append(change)
+            kept = change if source_is_newer else target.read_change(card_name)
+            conflicts.append(Conflict(card_name, kept['origin'], other_name))
+        target.save_synced_cards(accepted)
+        written += len(accepted)
+    return written
+
+
+def _free_branch_name(card_name: str, *databases: NoteDatabase) -> Optional[str]:
+    """ Return the name of a new branch of the card that is free in all the databases """
+    card = CN.parse(card_name)
+    if not card:
+        return None
+    last_children = [child for child in (database.last_child(card) for database in databases) if child]
+    last_child = max(last_children, key=lambda child: child.sort_key, default=None)
+    return CN.next_child_name(card, last_child)
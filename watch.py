@@ -0,0 +1,123 @@
+"""
+Save cards into the database as soon as they change. The notes directory is watched with
+the Linux inotify API through ctypes, so waiting for changes doesn't use CPU.
+
+The events are debounced: changed cards are saved when no card has changed for DEBOUNCE
+seconds, or at the latest MAX_DELAY seconds after the first change. Editors write a file
+with several events (vim also creates and removes a test file named 4913), and they are
+saved together in one transaction.
+"""
+
+import os
+import sys
+import time
+import ctypes
+import select
+import struct
+import ctypes.util
+from typing import *
+
+import card_name as CN
+from note_database import NoteDatabase
+from note_folder import NoteFiles
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+DEBOUNCE = 0.2
+MAX_DELAY = 0.8
+
+
+class Inotify:
+    """ Watch one directory for files that have been written or moved into it """
+    def __init__(self, directory: str, mask: int = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE):
+        libc_name = ctypes.util.find_library('c')
+        if not sys.platform.startswith('linux') or not libc_name:
+            raise EnvironmentError('Watching the notes folder needs the Linux inotify API')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        watch_descriptor = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), mask)
+        if watch_descriptor < 0:
+            error = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(error, f'inotify_add_watch failed: {directory}')
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def read_events(self) -> List[Tuple[int, str]]:
+        """ Return the pending events as (mask, file name) pairs """
+        try:
+            buffer = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(buffer):
+            _, mask, _, name_length = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = buffer[offset:offset + name_length].rstrip(b'\0')
+            offset += name_length
+            events.append((mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self._fd)
+
+
+def watch_directory(folder: NoteFiles, database: NoteDatabase, directory: str,
+                    on_save: Optional[Callable[[List[str]], None]] = None):
+    """ Save changed cards until interrupted
+    :param on_save: Called with the names of the cards after they have been saved
+    """
+    inotify = Inotify(directory)
+    pending: Set[str] = set()
+    first_event: Optional[float] = None
+    last_event = 0.0
+    try:
+        while True:
+            timeout = None
+            if pending:
+                now = time.monotonic()
+                timeout = max(0.0, min(last_event + DEBOUNCE, first_event + MAX_DELAY) - now)
+            readable, _, _ = select.select([inotify], [], [], timeout)
+
+            now = time.monotonic()
+            if readable:
+                for mask, file_name in inotify.read_events():
+                    if mask & IN_Q_OVERFLOW:
+                        # Events were lost, check every card in the folder
+                        folder.invalidate()
+                        pending.update(folder.find_all_notes())
+                    elif CN.parse(file_name):
+                        pending.add(file_name)
+                if pending and first_event is None:
+                    first_event = now
+                last_event = now
+            if not pending or (now < last_event + DEBOUNCE and now < first_event + MAX_DELAY):
+                continue
+
+            # Editors may have removed their temporary files by now
+            cards = [(name, folder.fullpath_of_open_card(name)) for name in sorted(pending)]
+            cards = [(name, path) for name, path in cards if os.path.isfile(path)]
+            try:
+                if cards:
+                    database.save_cards(cards)
+                    if on_save:
+                        on_save([name for name, _ in cards])
+            except EnvironmentError as error:
+                # A card was removed while saving. It's saved again when it's written the next time.
+                print(f'Could not save cards: {error}', file=sys.stderr)
+            pending.clear()
+            first_event = None
+    finally:
+        inotify.close()
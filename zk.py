@@ -1,34 +1,30 @@
 import os
-import re
 import sys
-import glob
-import time
-import socket
-import logging
 import sqlite3
-import getpass
-import argparse
-import datetime as dt
 from typing import *
 
-import new_note
-import note_folder as NF
 from note_folder import NoteFiles
 from note_folder import NotesDirectory
-from note_database import NoteDatabase
-import daily
-import scripts.bump_version as bump_version
-import database_init
-
-log = logging.getLogger(__name__)
+from note_database import NoteDatabase, StoredStat
+import database_connection
+import database_functions
+import profiling
 
 
 class Notes:
-    def __init__(self, directory_path: str, database_path: str):
-        self._sqlite_connection = sqlite3.connect(database_path)
+    def __init__(self, directory_path: Optional[str], database_path: str, compression: Tuple[str, int] = None):
+        """
+        :param directory_path: Folder of the open cards, or None for the default, see check_open_notes_directory
+        :param compression: Codec and level for new card contents, see compression_from_environment
+        """
+        codec, level = compression or (database_functions.DEFAULT_CODEC, database_functions.DEFAULT_LEVEL)
+        factory = profiling.TracedConnection if profiling.active() else sqlite3.Connection
+        self._sqlite_connection = database_connection.connect(database_path, factory=factory)
+        if directory_path is None:
+            directory_path = check_open_notes_directory(self._sqlite_connection)
         self._directory = NotesDirectory(directory_path)
         self._card_files = NoteFiles(self._directory)
-        self._card_storage = NoteDatabase(self._sqlite_connection)
+        self._card_storage = NoteDatabase(self._sqlite_connection, codec=codec, level=level)
 
     @property
     def open_notes(self):
@@ -42,6 +38,29 @@ class Notes:
     def database_handle(self):
         return self._sqlite_connection
 
+    @property
+    def directory_path(self):
+        return self._directory._directory
+
+    def iter_notes(self, start_after: Optional[str] = None, page_size: Optional[int] = None) -> Iterator['note.Note']:
+        """ Yield the cards of the folder and the database as note.Note objects in natural order
+        :param start_after: Start after this card, e.g. the last card of the previous page
+        """
+        import note
+        return note.iter_notes(self, start_after, page_size or note.PAGE_SIZE)
+
+    def notes_page(self, start_after: Optional[str] = None, count: int = 50) -> List['note.Note']:
+        """ Return the next `count` cards after the card in natural order """
+        import itertools
+        return list(itertools.islice(self.iter_notes(start_after, page_size=count), count))
+
+
+def compression_from_environment() -> Tuple[str, int]:
+    """ Read the compression of new card contents from ZK_COMPRESSION, e.g. `zlib:9`, `lzma` or `raw` """
+    setting = os.environ.get('ZK_COMPRESSION', database_functions.DEFAULT_CODEC)
+    codec, _, level = setting.partition(':')
+    return (codec, int(level) if level else database_functions.DEFAULT_LEVEL)
+
 
 def check_database(database_path: str) -> bool:
     """ Check if there's an notes database in the path of giben argument
@@ -68,10 +87,15 @@ def check_open_notes_directory(database_handle: sqlite3.Connection) -> str:
     return os.getcwd()
 
 
-def save_open_notes_into_database(app: Notes):
-    for card_name in app.open_notes.find_all_notes():
-        card_path = app.open_notes.fullpath_of_open_card(card_name)
-        app.persistent_notes.save_card(card_name, card_path)
+def save_open_notes_into_database(app: Notes, batch_size: int = NoteDatabase.DEFAULT_BATCH_SIZE,
+                                  progress: Optional[Callable[[int], None]] = None) -> Set[str]:
+    """ Save all open cards in one transaction
+    :return: Names of the saved cards
+    """
+    stats = app.open_notes.stat_of_open_cards()
+    cards = ((card_name, app.open_notes.fullpath_of_open_card(card_name)) for card_name in sorted(stats))
+    app.persistent_notes.save_cards(cards, batch_size=batch_size, progress=progress, stats=stats)
+    return set(stats)
 
 
 def remove_default_location(app: Notes):
@@ -92,127 +116,522 @@ def set_default_location(app: Notes, note_folder: str):
         cursor.execute('insert into default_directory(absolute_path) values (?)', args)
 
 
-def pack_open_notes_into_database(app: Notes):
-    """ Save files into database and remove all files """
-    save_open_notes_into_database(app)
-    notes = app.open_notes.find_all_notes()
-    for card_name in notes:
+def pack_open_notes_into_database(app: Notes, batch_size: int = NoteDatabase.DEFAULT_BATCH_SIZE,
+                                  progress: Optional[Callable[[int], None]] = None, verify: bool = True) -> List[str]:
+    """ Save files into database and remove all files
+    :param verify: Hash the files again after saving and keep the ones that differ from the saved content
+    :return: Names of the cards that were kept in the folder
+    """
+    notes = save_open_notes_into_database(app, batch_size=batch_size, progress=progress)
+    kept = []
+    if verify:
+        import fsck
+        kept = fsck.verify_saved_cards(app, sorted(notes), batch_size=batch_size)
+    for card_name in notes.difference(kept):
         card_path = app.open_notes.fullpath_of_open_card(card_name)
         os.unlink(card_path)
+    return kept
+
 
+class UnpackResult(NamedTuple):
+    written: int
+    up_to_date: int
+    locally_modified: List[str]
 
-def unpack_open_notes_from_database(app: Notes):
-    cursor = app.database_handle.cursor()
-    cursor.execute('select name, content, created_utc, modified_utc from notes;')
-    for row in cursor.fetchall():
-        card_name, content, created_utc, modified_utc = row
-        card_name, content, created_utc, modified_utc = str(card_name), bytes(content), int(created_utc), int(modified_utc)
 
-        app.open_notes.create_card_with_modified_time(card_name=card_name, content=content, modified_utc=modified_utc)
+def unpack_open_notes_from_database(app: Notes, batch_size: int = NoteDatabase.DEFAULT_BATCH_SIZE,
+                                    workers: Optional[int] = None) -> UnpackResult:
+    """ Write the cards that are missing from the folder or stale, see note_database.is_stale_file.
+    The cards are read `batch_size` at a time and written on a thread pool. Files that are older
+    than the saved cards are hashed, and only replaced if they have the content of an earlier
+    revision. Cards whose files have been modified since they were saved are left as they are.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from database_functions import file_content_hash
+    from note_database import is_older_file, is_stale_file
+
+    open_stats = app.open_notes.stat_of_open_cards()
+    written = 0
+    up_to_date = 0
+    locally_modified = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for stored_stats in app.persistent_notes.iter_stored_stats(batch_size):
+            stale_cards = []
+            older_cards = []
+            for card_name, stored in stored_stats.items():
+                stat = open_stats.get(card_name)
+                if stat is None:
+                    stale_cards.append(card_name)
+                elif is_older_file(stat, stored):
+                    older_cards.append(card_name)
+                elif stat.st_mtime_ns == stored.mtime_ns:
+                    up_to_date += 1
+                else:
+                    locally_modified.append(card_name)
+
+            revision_hashes = app.persistent_notes.revision_hashes(older_cards)
+            for card_name in older_cards:
+                stored = stored_stats[card_name]
+                digest = file_content_hash(app.open_notes.fullpath_of_open_card(card_name))
+                if digest == stored.content_hash:
+                    up_to_date += 1
+                elif is_stale_file(open_stats[card_name], stored, digest, revision_hashes.get(card_name, set())):
+                    stale_cards.append(card_name)
+                else:
+                    locally_modified.append(card_name)
+
+            written += _write_saved_cards(app, stale_cards, stored_stats, pool)
+    app.open_notes.invalidate()
+    return UnpackResult(written, up_to_date, sorted(locally_modified))
+
+
+def unpack_cards(app: Notes, card_names: List[str], workers: Optional[int] = None) -> int:
+    """ Write the saved content of the cards into the folder, whether the files are modified or not
+    :return: Number of cards written
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from note_database import _batches
+
+    written = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for batch in _batches(card_names, NoteDatabase.DEFAULT_BATCH_SIZE):
+            written += _write_saved_cards(app, batch, app.persistent_notes.stored_stats(batch), pool)
+    app.open_notes.invalidate()
+    return written
+
+
+def _write_saved_cards(app: Notes, card_names: List[str], stored_stats: Dict[str, StoredStat], pool) -> int:
+    """ Write the cards with their saved modification times, the small ones on the pool """
+    import functools
+
+    blobs = app.persistent_notes.read_blobs(card_names)
+    jobs = []
+    for card_name, blob in blobs.items():
+        modified_ns = stored_stats[card_name].mtime_ns
+        if blob.data is None:
+            # Large cards are copied in chunks on this thread, which owns the database connection
+            copy_blob = functools.partial(app.persistent_notes.copy_blob, blob.rowid)
+            app.open_notes.write_card(card_name, copy_blob, modified_ns)
+        else:
+            jobs.append(pool.submit(_unpack_card, app.open_notes, card_name, blob.codec, blob.data, modified_ns))
+    for job in jobs:
+        job.result()
+    return len(blobs)
+
+
+def _unpack_card(open_notes: NoteFiles, card_name: str, codec: str, data: bytes, modified_ns: int):
+    open_notes.write_card(card_name, database_functions.decompress(codec, data), modified_ns)
+
+
+def save_options(args: List[str]) -> Dict[str, Any]:
+    """ Parse the options of save and pack, i.e. `--batch-size N`. Progress is reported
+    only to an interactive terminal. """
+    options = {}
+    if '--batch-size' in args:
+        options['batch_size'] = int(args[args.index('--batch-size') + 1])
+    if sys.stderr.isatty():
+        options['progress'] = print_save_progress
+    return options
+
+
+def print_save_progress(saved: int):
+    print(f'\rSaved {saved} cards', end='', file=sys.stderr, flush=True)
 
 
 def hostname():
-    return socket.gethostname()
+    import note_database
+    return note_database.hostname()
 
 
 def open_editor(card_path: str):
     os.system("vim -c 'normal! jj' " + card_path)
 
 
-if __name__ == '__main__':
-    assert sys.argv[1] == '--database'
-    database_path = sys.argv[2]
-    assert str(database_path)
-    subcommand = sys.argv[3]
-    args = sys.argv[4:]
-
-    # Database initialization is handled separately from "normal" usage. Usage:
-    #    $ zk --database ./zk.db <init|upgrade 2|rollback 1>
-    if subcommand == 'init':
-        database_handle = sqlite3.connect(database_path)
-        database_init.initialize_database(database_handle)
-        database_handle.close()
-        sys.exit(0)
-    elif subcommand == 'upgrade':
-        next_version = int(args[0])
-        database_handle = sqlite3.connect(database_path)
-        bump_version.upgrade_version_up(database_handle, next_version)
-        database_handle.close()
-        sys.exit(0)
-    elif subcommand == 'rollback':
-        next_version = int(args[0])
-        database_handle = sqlite3.connect(database_path)
-        bump_version.rollback_version_down(database_handle, next_version)
-        database_handle.close()
-        sys.exit(0)
+# Subcommands. Each handler imports the modules it needs when it runs, so that starting zk
+# for one command doesn't pay for the imports of the others.
+COMMANDS: Dict[str, Callable[[Notes, List[str]], None]] = {}
 
-    if database_path and not check_database(database_path):
-        raise EnvironmentError('the database is missing')
+# Database initialization is handled separately from "normal" usage. Usage:
+#    $ zk --database ./zk.db <init|upgrade 2|rollback 1>
+DATABASE_COMMANDS: Dict[str, Callable[[str, List[str]], None]] = {}
 
-    with sqlite3.connect(database_path) as connection_handle:
-        note_folder = check_open_notes_directory(connection_handle)
 
-    app = notes = Notes(directory_path=note_folder, database_path=database_path)
-    open_notes = app.open_notes
-    persistent_notes = app.persistent_notes
+def command(name: str, registry: Dict[str, Callable] = COMMANDS):
+    def register(handler: Callable) -> Callable:
+        registry[name] = handler
+        return handler
+    return register
 
 
-    # if len(open_notes.find_major_notes()) == 0:
-    #    raise EnvironmentError('This folder does not seem to be for notes. Initialize it first')
+@command('init', DATABASE_COMMANDS)
+def init_command(database_path: str, args: List[str]):
+    import database_init
+    database_handle = database_connection.connect(database_path)
+    database_init.initialize_database(database_handle)
+    database_handle.close()
+
+
+@command('upgrade', DATABASE_COMMANDS)
+def upgrade_command(database_path: str, args: List[str]):
+    """ zk upgrade [version]. Upgrades to the latest version by default, or continues an interrupted upgrade. """
+    import migrations
+    database_handle = database_connection.connect(database_path)
+    next_version = int(args[0]) if args else migrations.latest_version()
+    if next_version < migrations.current_version(database_handle):
+        raise RuntimeError(f'Use rollback to go back to the version {next_version}')
+    migrate_database(database_handle, next_version)
+    database_handle.close()
 
-    # Actions
-    if subcommand == 'card':
-        content = dt.datetime.now().strftime('%F\n\n\n')
-        card_name = new_note.next_available_major_note(notes.open_notes, notes.persistent_notes)
+
+@command('rollback', DATABASE_COMMANDS)
+def rollback_command(database_path: str, args: List[str]):
+    """ zk rollback <version> """
+    import migrations
+    database_handle = database_connection.connect(database_path)
+    next_version = int(args[0])
+    if next_version > migrations.current_version(database_handle):
+        raise RuntimeError(f'Use upgrade to go to the version {next_version}')
+    migrate_database(database_handle, next_version)
+    database_handle.close()
+
+
+def migrate_database(database_handle: sqlite3.Connection, next_version: int):
+    import migrations
+    progress = print_migration_progress if sys.stderr.isatty() else None
+    for step in migrations.migrate(database_handle, next_version, progress=progress):
+        print(f'{step.name}', file=sys.stderr if progress else sys.stdout)
+
+
+def print_migration_progress(step, rowid: int, max_rowid: int):
+    print(f'\r{step.name}: {rowid} / {max_rowid} rows', end='', file=sys.stderr, flush=True)
+
+
+@command('card')
+def card_command(notes: Notes, args: List[str]):
+    import datetime as dt
+    import new_note
+    content = dt.datetime.now().strftime('%F\n\n\n')
+    card_name = new_note.next_available_major_note(notes.open_notes, notes.persistent_notes)
+    card_path = notes.open_notes.create_new_card(card_name, content)
+    open_editor(card_path)
+
+
+@command('branch')
+def branch_command(notes: Notes, args: List[str]):
+    import new_note
+    card_name = new_note.next_available_subcard_name(args[0], notes.open_notes, notes.persistent_notes)
+    if card_name:
+        content = ''
         card_path = notes.open_notes.create_new_card(card_name, content)
         open_editor(card_path)
-    elif subcommand == 'branch':
-        card_name = new_note.next_available_subcard_name(args[0], notes.open_notes, notes.persistent_notes)
-        if card_name:
-            content = ''
-            card_path = notes.open_notes.create_new_card(card_name, content)
-            open_editor(card_path)
-        else:
-            raise RuntimeError("Too many notes for this major card. The sub-card 'z' already exists.")
-    elif subcommand == 'daily':
-        # Saves the card immediately into the database
-        date = daily.smart_date(args)
-        card_name = daily.daily_card_name(date, notes.database_handle)
-        if not card_name:
+    else:
+        raise RuntimeError("Too many branches for this card. The sub-card 'z' already exists.")
+
+
+@command('daily')
+def daily_command(notes: Notes, args: List[str]):
+    import daily
+    import new_note
+    # Saves the card immediately into the database
+    date = daily.smart_date(args)
+    card_name = daily.daily_card_name(date, notes.database_handle)
+    if not card_name:
+        minimum_major = new_note.largest_open_major_number(notes.open_notes)
+        card_name, reserved = daily.reserve_daily_card(date, notes.persistent_notes, notes.database_handle, minimum_major)
+        if reserved:
             content = date.strftime('%F Daily\n\n\n')
-            card_name = new_note.next_available_major_note(notes.open_notes, notes.persistent_notes)
             card_path = notes.open_notes.create_new_card(card_name, content)
-            notes.persistent_notes.save(card_name, card_path)
-            daily.set_the_daily_card(card_name, date, notes.database_handle)
+            notes.persistent_notes.save_card(card_name, card_path)
+    card_path = notes.open_notes.fullpath_of_open_card(card_name)
+    open_editor(card_path)
+
+
+@command('save')
+def save_command(notes: Notes, args: List[str]):
+    options = save_options(args)
+    save_open_notes_into_database(app=notes, **options)
+    if 'progress' in options:
+        print(file=sys.stderr)
+
+
+@command('pack')
+def pack_command(notes: Notes, args: List[str]):
+    """ zk pack [--batch-size N] [--no-verify] """
+    options = save_options(args)
+    kept = pack_open_notes_into_database(app=notes, verify='--no-verify' not in args, **options)
+    if 'progress' in options:
+        print(file=sys.stderr)
+    for card_name in kept:
+        print(f'Kept {card_name}: the file differs from the saved card', file=sys.stderr)
+
+
+@command('unpack')
+def unpack_command(notes: Notes, args: List[str]):
+    result = unpack_open_notes_from_database(app=notes)
+    print(f'Unpacked {result.written} cards, {result.up_to_date} cards were up to date')
+    if result.locally_modified:
+        print('Kept modified cards: ' + str(result.locally_modified))
+
+
+@command('show')
+def show_command(notes: Notes, args: List[str]):
+    import card_name as CN
+    import note_folder as NF
+    if len(args) == 0:
+        no_command(notes, args)
+    elif args[0] == 'modified':
+        cards = NF.modified_cards(notes.open_notes, notes.database_handle)
+        print('Modified cards: ' + str(sorted(cards)))
+    elif args[0] == 'new':
+        cards = NF.new_cards(notes.open_notes, notes.database_handle)
+        print('New cards: ' + str(sorted(cards)))
+    elif args[0] == 'date':
+        print('\n'.join(notes.persistent_notes.cards_of_date(args[1])))
+    elif args[0] == 'tag':
+        print('\n'.join(notes.persistent_notes.cards_with_tag(args[1].lstrip('#'))))
+    elif args[0] in ('children', 'tree'):
+        card = CN.parse(args[1])
+        if not card:
+            raise RuntimeError(f'Invalid card name: {args[1]}')
+        if args[0] == 'children':
+            print('\n'.join(notes.persistent_notes.find_children(card)))
         else:
-            card_path = notes.open_notes.fullpath_of_open_card(card_name)
-        open_editor(card_path)
-    elif subcommand == 'save':
-        save_open_notes_into_database(app=notes)
-    elif subcommand == 'pack':
-        pack_open_notes_into_database(app=notes)
-    elif subcommand == 'unpack':
-        unpack_open_notes_from_database(app=notes)
-    elif subcommand == 'show' and len(args) > 0:
-        show_cards = set()
-        if args[0] == 'modified':
-            cards = NF.modified_cards(notes.open_notes, notes.database_handle)
-            print('Modified cards: ' + str(sorted(cards)))
-        elif args[0] == 'new':
-            cards = NF.new_cards(notes.open_notes, notes.database_handle)
-            print('New cards: ' + str(sorted(cards)))
-    elif subcommand == '--set-default-directory':
-        set_default_location(notes, args[0])
-    elif subcommand == '--remove-default-directory':
-        remove_default_location(notes)
-    elif subcommand == 'script':
-        import importlib
-        script_module_name = 'scripts.' + args[0]
-        script_module = importlib.import_module(script_module_name)
-        if not hasattr(script_module, 'run'):
-            raise RuntimeError(f'Invalid script path: {script_module_name}')
-        script_module.run(notes.database_handle)
+            print(card.name)
+            for descendant in notes.persistent_notes.find_descendants(card):
+                print('  ' * (CN.parse(descendant).depth - card.depth) + descendant)
     else:
-        log.info('No command given')
-        print('No command given')
+        # zk show <card> or zk show <card>@<revision>
+        import revisions
+        card_name, _, revision = args[0].partition('@')
+        if revision:
+            content = revisions.read_revision(notes.database_handle, card_name, int(revision))
+        else:
+            content = notes.persistent_notes.read_card(card_name)
+        if content is None:
+            raise RuntimeError(f'Missing card: {args[0]}')
+        sys.stdout.buffer.write(content)
+
+
+@command('status')
+def status_command(notes: Notes, args: List[str]):
+    """ zk status [--all] [--json]. Prints `<status>\t<card>` lines of the new, modified, deleted and stale
+    cards, and with --all also the unchanged ones. --json prints the card names by status. """
+    import card_name as CN
+    import note_folder as NF
+    status = NF.card_status(notes.open_notes, notes.database_handle)
+    card_names = sorted(status, key=CN.natural_key)
+    if '--json' in args:
+        import json
+        statuses = (NF.NEW, NF.MODIFIED, NF.DELETED, NF.STALE, NF.UNCHANGED)
+        print(json.dumps({kind: [card_name for card_name in card_names if status[card_name] == kind] for kind in statuses}))
+        return
+    for card_name in card_names:
+        if status[card_name] != NF.UNCHANGED or '--all' in args:
+            print(f'{status[card_name]}\t{card_name}')
+
+
+@command('fsck')
+def fsck_command(notes: Notes, args: List[str]):
+    """ zk fsck [--blobs]. Prints `<problem>\t<subject>\t<detail>` lines and exits with 1 if there are problems. """
+    import fsck
+    problems = fsck.check(notes, blobs='--blobs' in args)
+    for problem in problems:
+        print(f'{problem.kind}\t{problem.subject}\t{problem.detail}')
+    if problems:
+        sys.exit(1)
+
+
+@command('log')
+def log_command(notes: Notes, args: List[str]):
+    import datetime as dt
+    import revisions
+    for revision in revisions.card_log(notes.database_handle, args[0]):
+        modified = dt.datetime.fromtimestamp(revision.modified_utc).strftime('%F %T')
+        print(f'{args[0]}@{revision.revision}  {modified}  {revision.size} B  ({revision.kind}, {revision.stored_size} B stored)')
+
+
+@command('watch')
+def watch_command(notes: Notes, args: List[str]):
+    import datetime as dt
+    import watch
+    on_save = lambda card_names: print(dt.datetime.now().strftime('%T') + ' Saved ' + ' '.join(card_names), flush=True)
+    try:
+        watch.watch_directory(notes.open_notes, notes.persistent_notes, notes.directory_path, on_save=on_save)
+    except KeyboardInterrupt:
+        pass
+
+
+@command('sync')
+def sync_command(notes: Notes, args: List[str]):
+    """ zk sync <other database> [--keep-both] """
+    import sync
+    other_path = args[0]
+    if not check_database(other_path):
+        raise EnvironmentError(f'The database {other_path} is missing')
+    policy = sync.KEEP_BOTH if '--keep-both' in args else sync.MTIME
+    other_handle = database_connection.connect(other_path)
+    try:
+        result = sync.sync(notes.database_handle, other_handle, policy, open_notes=notes.open_notes)
+    finally:
+        other_handle.close()
+    unpack_cards(notes, result.outdated_files)
+    print(f'Received {result.pulled} cards, sent {result.pushed} cards, updated {len(result.outdated_files)} open cards')
+    for conflict in result.conflicts:
+        print(f'Conflict in {conflict.card_name}: kept the version from {conflict.kept_origin}'
+              + (f', the other version is {conflict.other_name}' if conflict.other_name else ''))
+
+
+@command('export')
+def export_command(notes: Notes, args: List[str]):
+    """ zk export <archive>. Run again to complete an interrupted export. """
+    import archive
+    result = archive.export_archive(notes.database_handle, args[0])
+    print(f'Exported {result.cards} cards and {result.daily} daily notes')
+
+
+@command('import')
+def import_command(notes: Notes, args: List[str]):
+    """ zk import <archive> """
+    import archive
+    result = archive.import_archive(notes.database_handle, args[0])
+    print(f'Imported {result.cards} cards and {result.daily} daily notes, {result.up_to_date} cards were up to date')
+
+
+@command('search')
+def search_command(notes: Notes, args: List[str]):
+    for card_name, snippet in notes.persistent_notes.search(' '.join(args)):
+        print(f'{card_name}: ' + ' '.join(snippet.split()))
+
+
+@command('reindex')
+def reindex_command(notes: Notes, args: List[str]):
+    notes.persistent_notes.rebuild_search_index()
+    notes.persistent_notes.rebuild_links()
+
+
+@command('backlinks')
+def backlinks_command(notes: Notes, args: List[str]):
+    import card_name as CN
+    for card_name in sorted(notes.persistent_notes.backlinks(args[0]), key=CN.natural_key):
+        print(card_name)
+
+
+@command('graph')
+def graph_command(notes: Notes, args: List[str]):
+    """ zk graph <card> [hops] [--dot]. Prints the cards within `hops` links (2 by default) with their
+    distance, or with --dot the links between them in the Graphviz format. """
+    import card_name as CN
+    options = [arg for arg in args if not arg.startswith('--')]
+    hops = int(options[1]) if len(options) > 1 else 2
+    distances = notes.persistent_notes.neighbourhood(options[0], hops)
+    if '--dot' in args:
+        print('digraph zk {')
+        for src, dst in sorted(notes.persistent_notes.links_between(distances)):
+            print(f'    "{src}" -> "{dst}";')
+        print('}')
+        return
+    for card_name in sorted(distances, key=lambda name: (distances[name], CN.natural_key(name))):
+        print(f'{distances[card_name]}\t{card_name}')
+
+
+@command('recent')
+def recent_command(notes: Notes, args: List[str]):
+    """ zk recent [N|YYYY-MM-DD]. Prints the N (20 by default) most recently modified cards,
+    or all cards modified since the date. """
+    import itertools
+    import datetime as dt
+    count, since_ns = 20, None
+    if args and args[0].isdigit():
+        count = int(args[0])
+    elif args:
+        count = None
+        since_ns = int(dt.datetime.fromisoformat(args[0]).timestamp()) * 1_000_000_000
+    cards = notes.persistent_notes.iter_recent_cards(since_ns, page_size=min(count or 1000, 1000))
+    for card_name, modified_ns, title in itertools.islice(cards, count):
+        modified = dt.datetime.fromtimestamp(modified_ns / 1_000_000_000).strftime('%F %T')
+        print(f'{modified}  {card_name}  {title or ""}')
+
+
+@command('--set-default-directory')
+def set_default_directory_command(notes: Notes, args: List[str]):
+    set_default_location(notes, args[0])
+
+
+@command('--remove-default-directory')
+def remove_default_directory_command(notes: Notes, args: List[str]):
+    remove_default_location(notes)
+
+
+@command('script')
+def script_command(notes: Notes, args: List[str]):
+    """ zk script <name>. Runs scripts/<name>.py, see scripting for the API that the scripts can use. """
+    import importlib
+    script_module_name = 'scripts.' + args[0]
+    script_module = importlib.import_module(script_module_name)
+    if not hasattr(script_module, 'run'):
+        raise RuntimeError(f'Invalid script path: {script_module_name}')
+    script_module.run(notes.database_handle)
+
+
+def no_command(notes: Notes, args: List[str]):
+    import logging
+    logging.getLogger(__name__).info('No command given')
+    print('No command given')
+
+
+def profile_option(argv: List[str]) -> Tuple[List[str], Optional[str]]:
+    """ Remove the option --profile[=FILE] from the arguments. The option overrides ZK_PROFILE.
+    :return: The other arguments and None if profiling is off, '' to print only the summary, or the
+        file for the cProfile statistics
+    """
+    setting = os.environ.get('ZK_PROFILE', '')
+    setting = None if setting in ('', '0') else '' if setting == '1' else setting
+    other_args = []
+    for arg in argv:
+        if arg == '--profile':
+            setting = ''
+        elif arg.startswith('--profile='):
+            setting = arg[len('--profile='):]
+        else:
+            other_args.append(arg)
+    return other_args, setting
+
+
+def main(argv: List[str]):
+    argv, profile_output = profile_option(argv)
+    if profile_output is None:
+        run(argv)
+        return
+    profile = profiling.start(profile_output or None)
+    try:
+        run(argv)
+    finally:
+        profiling.stop()
+        profile.print_summary(sys.stderr)
+
+
+def run(argv: List[str]):
+    assert argv[1] == '--database'
+    database_path = argv[2]
+    assert str(database_path)
+    subcommand = argv[3]
+    args = argv[4:]
+
+    if subcommand in DATABASE_COMMANDS:
+        DATABASE_COMMANDS[subcommand](database_path, args)
+        return
+
+    if database_path and not check_database(database_path):
+        raise EnvironmentError('the database is missing')
 
+    notes = Notes(directory_path=None, database_path=database_path, compression=compression_from_environment())
+
+    # if len(notes.open_notes.find_major_notes()) == 0:
+    #    raise EnvironmentError('This folder does not seem to be for notes. Initialize it first')
+
+    handler = COMMANDS.get(subcommand, no_command)
+    handler(notes, args)
+
+
+if __name__ == '__main__':
+    main(sys.argv)